@@ -0,0 +1,4 @@
+'''Microbenchmarks of the request pipeline
+
+Run with: python -m bench [--sizes 10,100,1000,10000] [--output results.jsonl]
+'''
@@ -0,0 +1,152 @@
+import argparse
+import json
+import platform
+import sys
+import tracemalloc
+
+from subprocess import CalledProcessError, check_output
+from time import perf_counter_ns
+
+from rs.application import WSGIApplication
+from rs.context import Context
+from rs.error import Error
+from rs.request import RequestDispatcher
+
+from bench.synthetic import make_resources, make_environs, fresh
+
+
+def start_response(status, headers, exc_info=None):
+    pass
+
+
+def consume(body):
+    for chunk in body:
+        pass
+    if hasattr(body, 'close'):
+        body.close()
+
+
+def stages(app, environs):
+    '''Yield (stage name, function of an environ) pairs
+
+    Each function prepares what it needs and returns the callable timed.
+    '''
+    def end_to_end(environ):
+        return lambda: consume(app(fresh(environ), start_response))
+
+    def complete_request(environ):
+        return lambda: app.complete_request(fresh(environ))
+
+    def dispatch(environ):
+        request = app.complete_request(fresh(environ))
+        dispatcher = RequestDispatcher(app.resources_manager.resources)
+        return lambda: _ignore_errors(dispatcher.dispatch, request)
+
+    def get_target_params(environ):
+        request = app.complete_request(fresh(environ))
+        try:
+            context = Context(app, request)
+        except Error:
+            return None
+        return lambda: dict(context.get_target_params())
+
+    def complete_response(environ):
+        request = app.complete_request(fresh(environ))
+        try:
+            with Context(app, request) as context:
+                response = context.get_response()
+        except Error as e:
+            response = e
+        entity, headers = response.entity, dict(response.headers)
+        def run():
+            response.entity, response.headers = entity, dict(headers)
+            consume(app.complete_response(response, environ, start_response))
+        return run
+
+    return [('end_to_end', end_to_end),
+            ('complete_request', complete_request),
+            ('dispatch', dispatch),
+            ('get_target_params', get_target_params),
+            ('complete_response', complete_response)]
+
+
+def measure(prepare, environs, repeat):
+    '''Return (ns per op, peak traced bytes per op, ops)
+
+    '''
+    runs = [run for run in map(prepare, environs) if run is not None]
+    if not runs:
+        return None, None, 0
+    for run in runs: # warm up
+        run()
+    started = perf_counter_ns()
+    for _ in range(repeat):
+        for run in runs:
+            run()
+    elapsed = perf_counter_ns() - started
+    ops = repeat * len(runs)
+    peak = 0
+    tracemalloc.start()
+    try:
+        for run in runs:
+            tracemalloc.reset_peak()
+            current = tracemalloc.get_traced_memory()[0]
+            run()
+            peak += tracemalloc.get_traced_memory()[1] - current
+    finally:
+        tracemalloc.stop()
+    return elapsed / ops, peak / len(runs), ops
+
+
+def commit():
+    try:
+        return check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                            universal_newlines=True).strip()
+    except (OSError, CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m bench')
+    parser.add_argument('--sizes', default='10,100,1000,10000',
+                        help='comma separated numbers of resources')
+    parser.add_argument('--requests', type=int, default=200,
+                        help='distinct synthetic requests per size')
+    parser.add_argument('--repeat', type=int, default=20,
+                        help='times each request is run')
+    parser.add_argument('--stages', default=None,
+                        help='comma separated stages, all by default')
+    parser.add_argument('--output', default=None,
+                        help='file the JSON lines are appended to')
+    args = parser.parse_args(argv)
+
+    meta = {'commit': commit(),
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation()}
+    output = open(args.output, 'a') if args.output else sys.stdout
+    try:
+        for size in [int(s) for s in args.sizes.split(',')]:
+            app = WSGIApplication(make_resources(size))
+            environs = make_environs(size, args.requests)
+            for stage, prepare in stages(app, environs):
+                if args.stages and stage not in args.stages.split(','):
+                    continue
+                ns, peak, ops = measure(prepare, environs, args.repeat)
+                result = dict(meta, resources=size, stage=stage, ops=ops,
+                              ns_per_op=ns, peak_bytes_per_op=peak)
+                output.write(json.dumps(result, sort_keys=True) + '\n')
+                output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+def _ignore_errors(func, *args):
+    try:
+        return func(*args)
+    except Error as e:
+        return e
+
+
+if __name__ == '__main__':
+    main()
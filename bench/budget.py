@@ -0,0 +1,88 @@
+'''Allocation budget of a simple GET
+
+Run with: python -m bench.budget
+
+Exits with status 1 when a request allocates more memory blocks (counted
+while the target runs, so covering the request, its Context and the
+dispatch results) or peaks at more traced bytes than allowed.
+'''
+import sys
+import tracemalloc
+
+from io import BytesIO
+
+from rs.application import WSGIApplication
+from rs.core import RestDict, set_rest_dict
+
+
+MAX_BLOCKS = 28       # memory blocks alive while the target runs
+MAX_PEAK_BYTES = 2560 # traced bytes peak of a whole request
+
+
+_snapshots = [] # taken by the target when not None
+
+
+def hello(id):
+    if _snapshots is not None and tracemalloc.is_tracing():
+        _snapshots.append(tracemalloc.take_snapshot())
+    return 'hello'
+
+
+def environ():
+    return {'SERVER_PROTOCOL': 'HTTP/1.1',
+            'REQUEST_METHOD': 'GET',
+            'PATH_INFO': '/hello/42',
+            'QUERY_STRING': '',
+            'HTTP_HOST': 'localhost',
+            'HTTP_ACCEPT': '*/*',
+            'wsgi.input': BytesIO()}
+
+
+def start_response(status, headers, exc_info=None):
+    pass
+
+
+def measure(app, requests=20):
+    '''Return the (blocks, peak bytes) medians of requests simple GETs
+
+    '''
+    global _snapshots
+    for _ in range(requests): # warm up caches
+        list(app(environ(), start_response))
+    filters = [tracemalloc.Filter(False, tracemalloc.__file__),
+               tracemalloc.Filter(False, __file__)]
+    blocks, peaks = [], []
+    tracemalloc.start()
+    try:
+        _snapshots = None
+        for _ in range(requests):
+            env = environ()
+            tracemalloc.reset_peak()
+            current = tracemalloc.get_traced_memory()[0]
+            list(app(env, start_response))
+            peaks.append(tracemalloc.get_traced_memory()[1] - current)
+        _snapshots = []
+        for _ in range(requests):
+            env = environ()
+            before = tracemalloc.take_snapshot().filter_traces(filters)
+            list(app(env, start_response))
+            during = _snapshots.pop().filter_traces(filters)
+            blocks.append(sum(stat.count_diff for stat in
+                              during.compare_to(before, 'lineno')
+                              if stat.count_diff > 0))
+    finally:
+        tracemalloc.stop()
+    median = lambda values: sorted(values)[len(values) // 2]
+    return median(blocks), median(peaks)
+
+
+def main():
+    set_rest_dict(hello, RestDict(method='GET', path='/hello/{id}'))
+    blocks, peak = measure(WSGIApplication([hello]))
+    print('blocks: {0} (max {1}), peak bytes: {2} (max {3})'
+          .format(blocks, MAX_BLOCKS, peak, MAX_PEAK_BYTES))
+    return 0 if blocks <= MAX_BLOCKS and peak <= MAX_PEAK_BYTES else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
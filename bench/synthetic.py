@@ -0,0 +1,113 @@
+import json
+
+from io import BytesIO
+from random import Random
+
+from rs.context import Context
+from rs.core import RestDict, set_rest_dict
+
+
+__all__ = [
+    'make_resources',
+    'make_environs',
+]
+
+
+def make_resources(size, seed=0):
+    '''Return size resource functions with mixed static and param paths
+
+    The functions are not added to rs.core.registry.
+    '''
+    random = Random(seed)
+    resources = []
+    for i in range(size):
+        kind = i % 4
+        if kind == 0:
+            path, target = '/svc{0}/items'.format(i // 4), _list
+        elif kind == 1:
+            path, target = '/svc{0}/items/{{id}}'.format(i // 4), _one
+        elif kind == 2:
+            path = '/svc{0}/items/{{id}}/sub/{{sub}}'.format(i // 4)
+            target = _sub
+        else:
+            path, target = '/svc{0}/items'.format(i // 4), _create
+        rest_dict = RestDict(path=path,
+                             method='POST' if target is _create else 'GET')
+        if target is _create:
+            rest_dict.consumer = 'application/json', json.loads
+        if target is _create or random.random() < 0.5:
+            rest_dict.producer = 'application/json', json.dumps
+        resources.append(_copy(target, rest_dict))
+    return resources
+
+
+def make_environs(size, count=100, seed=0, miss_ratio=0.1):
+    '''Return count WSGI environs hitting the routes of make_resources(size)
+
+    '''
+    random = Random(seed)
+    environs = []
+    for _ in range(count):
+        svc = random.randrange(max(size // 4, 1))
+        kind = random.randrange(4)
+        method, body = 'GET', b''
+        if random.random() < miss_ratio:
+            path = '/missing{0}/items'.format(svc)
+        elif kind == 0:
+            path = '/svc{0}/items'.format(svc)
+        elif kind == 1:
+            path = '/svc{0}/items/{1}'.format(svc, random.randrange(1000))
+        elif kind == 2:
+            path = '/svc{0}/items/{1}/sub/{2}'.format(
+                svc, random.randrange(1000), random.randrange(10))
+        else:
+            path, method = '/svc{0}/items'.format(svc), 'POST'
+            body = json.dumps({'n': random.randrange(1000)}).encode()
+        environs.append({
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'REQUEST_METHOD': method,
+            'PATH_INFO': path,
+            'QUERY_STRING': 'limit=10&offset=20',
+            'CONTENT_TYPE': 'application/json' if body else '',
+            'CONTENT_LENGTH': str(len(body)) if body else '',
+            'HTTP_ACCEPT': 'application/json, text/plain;q=0.9, */*;q=0.8',
+            'HTTP_HOST': 'localhost',
+            'HTTP_USER_AGENT': 'bench',
+            'HTTP_X_FORWARDED_FOR': '10.0.0.1',
+            'wsgi.input': BytesIO(body),
+        })
+    return environs
+
+
+def fresh(environ):
+    '''Copy of environ with a rewound wsgi.input
+
+    '''
+    environ = dict(environ)
+    environ['wsgi.input'] = BytesIO(environ['wsgi.input'].getvalue())
+    return environ
+
+
+def _list(limit='10', offset='0'):
+    return [int(offset), int(limit)]
+
+
+def _one(id, limit='10'):
+    return {'id': id, 'limit': limit}
+
+
+def _sub(id, sub):
+    return {'id': id, 'sub': sub}
+
+
+def _create(entity=Context.entity):
+    return entity, 201
+
+
+def _copy(function, rest_dict):
+    from types import FunctionType
+    copy = FunctionType(function.__code__, function.__globals__,
+                        function.__name__, function.__defaults__,
+                        function.__closure__)
+    set_rest_dict(copy, rest_dict)
+    return copy
@@ -1,4 +1,9 @@
 from rs.core import method, get, post, put, delete, path, produces, consumes
+from rs.core import scope, cache, etag, validators, compress, limit, deadline
+from rs.core import SINGLETON, THREAD, REQUEST, POOLED
+from rs.message import json_producer, json_consumer
 from rs.error import Error as error
 from rs.context import Context as context
 from rs.application import WSGIApplication as application
+from rs.asgi import ASGIApplication
+from rs.mount import PrefixDispatcher, ASGIPrefixDispatcher
@@ -1,12 +1,32 @@
 
 
 
+from functools import partial
 from logging import getLogger
+from sys import exc_info
+from threading import local, Condition, RLock, Thread
+from time import monotonic, perf_counter
+from traceback import format_exception
 
+from rs.batch import batch_resource
+from rs.context import Context
+from rs.core import (SINGLETON, THREAD, REQUEST, POOLED,
+                     has_rest_dict, get_rest_dict)
 from rs.error import Error
-from rs.status import (INTERNAL_SERVER_ERROR,
+from rs.limiter import Limiter
+from rs.lru import LRUCache
+from rs.message import (uri, is_stream, iter_chunks, EnvironHeaders,
+                        CHUNK_LENGTH)
+from rs.metrics import Metrics, metrics_resource
+from rs.request import Request, RequestEntity, RequestDispatcher, dispatch
+from rs.resource import ResourceTree, build_all
+from rs.response import Response
+from rs.status import (BAD_REQUEST,
+                       INTERNAL_SERVER_ERROR,
                        NOT_MODIFIED,
+                       OK,
                        NO_CONTENT,
+                       SERVICE_UNAVAILABLE,
                        responses)
 
 
@@ -17,24 +37,129 @@ __all__ = [
 
 _logger = getLogger(__name__)
 
-_CHUNK_LENGTH = 8192
 
-def _chunks(l, n=_CHUNK_LENGTH):
-    for i in range(0, len(l), n):
-        yield l[i:i+n]
+def _request_length(request):
+    stream = request and request.stream
+    if stream is None:
+        return 0
+    return stream.length if stream.length is not None else stream.consumed
+
+
+def _body_length(body):
+    return sum(len(chunk) for chunk in body) if isinstance(body, list) else 0
+
+
+def _close(entity):
+    if hasattr(entity, 'close'):
+        entity.close()
+
+
+class _Body(object):
+    '''Streamed response body calling on_close(bytes sent) once closed
+    
+    '''
+    __slots__ = ('_body', '_on_close', 'sent')
+
+    def __init__(self, body, on_close):
+        self._body = body
+        self._on_close = on_close
+        self.sent = 0
+
+    def __iter__(self):
+        for chunk in self._body:
+            self.sent += len(chunk)
+            yield chunk
+
+    def close(self):
+        try:
+            _close(self._body)
+        finally:
+            self._on_close(self.sent)
+
+
+def _stream(entity, environ):
+    if hasattr(entity, 'read'):
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        if file_wrapper and isinstance(entity.read(0), bytes):
+            return file_wrapper(entity, CHUNK_LENGTH)
+    return iter_chunks(entity, encoding='utf-8')
 
 
 class ResourceManager(object):
+    '''Holds the resource table, replaced as a whole when rebuilt
+    
+    The table is the (ResourceTree, dispatch cache) pair, read once per
+    request, so requests already dispatched finish on the old one.
+    '''
+    def init(self, resources, cache_size=None):
+        self.source = resources #None for the registry
+        self.cache_size = cache_size
+        self.extras = [] #built resources given to add()
+        self.lock = RLock() #serializes the rebuilds
+        self.publish(self.build())
 
-    def init(self, resources):
-        from rs.resource import build_all
+    def build(self, resources=None):
+        '''Build a table of resources, the source if None
+        
+        The resources given to add() are kept.
+        '''
+        if resources is None:
+            resources = self.source
         if resources is None:
             from rs.core import registry as resources
-        self.resources = build_all(resources) #all resources
+        tree = build_all(list(resources))
+        for resource in self.extras:
+            tree.add(resource)
+        return tree
+
+    def publish(self, resources):
+        self.table = (resources,
+                      LRUCache(self.cache_size) if self.cache_size else None)
+
+    @property
+    def resources(self):
+        return self.table[0]
+
+    @property
+    def cache(self):
+        return self.table[1]
 
     def get_resource(self, request):
-        from rs.request import dispatch
-        return dispatch(self.resources, request)
+        resources, cache = self.table
+        if cache is None:
+            return dispatch(resources, request)
+        dispatcher = RequestDispatcher(resources)
+        key = (request.uri.path,
+               request.method,
+               request.headers.get('content-type'),
+               request.headers.get('accept'))
+        resolved = cache.get(key)
+        if resolved is None:
+            try:
+                resolved = dispatcher.resolve(request)
+            except Error as e:
+                resolved = e
+            cache.set(key, resolved)
+        if isinstance(resolved, Error):
+            error = Error(resolved.status)
+            error.headers.update(resolved.headers)
+            raise error
+        resource, path_params = resolved
+        return resource, dispatcher.extract_params(request, dict(path_params))
+
+    def add(self, resource):
+        with self.lock:
+            self.extras.append(resource)
+            tree = ResourceTree(self.resources)
+            tree.add(resource)
+            self.publish(tree)
+
+    def invalidate(self):
+        if self.cache is not None:
+            self.cache.clear()
+
+    def cache_info(self):
+        return self.cache.info() if self.cache is not None else None
     
     def __getitem__(self, request):
         return self.get_resource(self, request)
@@ -42,48 +167,307 @@ class ResourceManager(object):
 
 
 class InstanceManager(object):
+    '''Builds and hands out instances of resource hosts by their scope
+    
+    '''
+    def init(self, resources=(), pool_timeout=5.0):
+        self.instances = {} #built singletons, read without locking
+        self.scopes = {}
+        self.pools = {} #type -> [Condition, idle instances, built count]
+        self.pool_timeout = pool_timeout
+        self.lock = RLock()
+        self.local = local()
+        self.warm(resources)
+
+    def warm(self, resources):
+        '''Build the singletons hosting resources
+        
+        '''
+        for resource in resources:
+            if (resource.host is not None and
+                self.get_scope(resource.host)[0] == SINGLETON):
+                self.get(resource.host)
+
+    def get_scope(self, type_):
+        if type_ not in self.scopes:
+            scope = has_rest_dict(type_) and get_rest_dict(type_).scope
+            self.scopes[type_] = scope or (None, None) #lazily built, shared
+        return self.scopes[type_]
+
+    def get(self, type_, context=None):
+        instance = self.instances.get(type_)
+        if instance is not None:
+            return instance
+        scope, size = self.get_scope(type_)
+        if scope == THREAD:
+            instances = self.local.__dict__.setdefault('instances', {})
+            if type_ not in instances:
+                instances[type_] = type_()
+            return instances[type_]
+        if scope in (REQUEST, POOLED):
+            if context is None:
+                raise ValueError('{0} has {1} scope, get it with a context'
+                                 .format(type_.__name__, scope))
+            scoped = context._instances
+            if type_ not in scoped:
+                scoped[type_] = (self.acquire(type_, size)
+                                 if scope == POOLED else type_())
+            return scoped[type_]
+        with self.lock:
+            if type_ not in self.instances:
+                self.instances[type_] = type_()
+            return self.instances[type_]
+
+    def acquire(self, type_, size):
+        '''Borrow an instance of the pool, raise 503 if none frees in time
+        
+        '''
+        with self.lock:
+            if type_ not in self.pools:
+                self.pools[type_] = [Condition(self.lock), [], 0]
+            pool = self.pools[type_]
+            if not pool[0].wait_for(lambda: pool[1] or pool[2] < size,
+                                    self.pool_timeout):
+                raise Error(SERVICE_UNAVAILABLE)
+            if pool[1]:
+                return pool[1].pop()
+            pool[2] += 1
+        try:
+            return type_()
+        except BaseException:
+            with self.lock: #give the slot back
+                pool[2] -= 1
+                pool[0].notify()
+            raise
 
-    def init(self):
-        self.instances = {}
+    def release(self, context):
+        with self.lock:
+            for type_, instance in context._instances.items():
+                if type_ in self.pools:
+                    self.pools[type_][1].append(instance)
+                    self.pools[type_][0].notify()
+        context._instances.clear()
 
     def __getitem__(self, type_):
-        if type_ is not None and type_ not in self.instances:
-            self.instances[type_] = type_()
-        return self.instances[type_]
+        return self.get(type_)
 
 
-class WSGIApplication(object):
+class CacheManager(object):
+    '''Caches encoded responses of resources declared with @rs.cache
+    
+    '''
+    def init(self, max_entries=1024, max_bytes=64 << 20):
+        self.cache = LRUCache(max_entries, max_bytes,
+                              lambda entry: len(entry[3]))
 
+    def key(self, context):
+        request, params = context.request, context.params
+        ttl, vary = context.resource.cache
+        return (context.resource,
+                tuple(sorted(params.path.items())),
+                tuple(sorted((k, tuple(v) if isinstance(v, list) else v)
+                             for k, v in params.query.items())),
+                context.resource._produces,
+                context.coding(),
+                tuple(request.headers.get(h) for h in vary))
+
+    def get(self, context):
+        if (not context.resource.cache or
+            context.request.method not in ('GET', 'HEAD')):
+            return None
+        entry = self.cache.get(self.key(context))
+        if entry is None:
+            return None
+        expires, status, headers, entity = entry
+        if expires is not None and expires < monotonic():
+            self.cache.discard(self.key(context))
+            return None
+        response = Response(status)
+        response.headers.update(headers)
+        response.entity = entity
+        return response
+
+    def vary(self, context, response):
+        if (not context.resource.cache or
+            context.request.method not in ('GET', 'HEAD')):
+            return
+        ttl, vary = context.resource.cache
+        if vary:
+            response.headers['vary'] = ', '.join(vary)
+
+    def set(self, context, response):
+        if (not context.resource.cache or
+            context.request.method not in ('GET', 'HEAD')):
+            return
+        ttl, vary = context.resource.cache
+        if response.status == OK and isinstance(response.entity, bytes):
+            self.cache.set(self.key(context),
+                           (monotonic() + ttl if ttl is not None else None,
+                            response.status,
+                            dict(response.headers),
+                            response.entity))
+
+    def invalidate(self, target=None):
+        '''Drop cached responses of the target, or all if target is None
+        
+        '''
+        for key in self.cache.keys():
+            if target is None or key[0].target is target:
+                self.cache.discard(key)
+
+    def cache_info(self):
+        return self.cache.info()
+
+
+class LimitManager(object):
+    '''Sheds the requests beyond the in flight limits
+    
+    Limits of resources declared with @rs.limit are checked first, then
+    the global one of the application.
+    '''
+    def init(self, max_in_flight=None, queue=0, timeout=0.5, retry_after=1):
+        self.limiter = (Limiter(max_in_flight, queue, timeout, retry_after)
+                        if max_in_flight else None)
+        self.limiters = {} #resource -> Limiter, lazily built
+        self.lock = RLock()
+
+    def limited(self, resource, app_limit=True):
+        return bool(resource.limit) or (app_limit and
+                                        self.limiter is not None)
+
+    def get(self, resource):
+        limiter = self.limiters.get(resource)
+        if limiter is None and resource.limit:
+            with self.lock:
+                if resource not in self.limiters:
+                    self.limiters[resource] = Limiter(*resource.limit)
+                limiter = self.limiters[resource]
+        return limiter
+
+    def acquire(self, resource, app_limit=True):
+        '''Take a slot of every limit, raise 503 if one is refused
+        
+        '''
+        if not self.limited(resource, app_limit):
+            return
+        acquired = []
+        for limiter in (self.get(resource), app_limit and self.limiter):
+            if not limiter:
+                continue
+            if not limiter.acquire():
+                for taken in acquired:
+                    taken.release()
+                error = Error(SERVICE_UNAVAILABLE)
+                error.headers['retry-after'] = str(limiter.retry_after)
+                raise error
+            acquired.append(limiter)
+
+    def retain(self, resources):
+        '''Forget the limiters of idle resources not in resources
+        
+        '''
+        with self.lock:
+            resources = set(resources)
+            self.limiters = dict((r, l) for r, l in self.limiters.items()
+                                 if r in resources or l.in_flight)
+
+    def release(self, resource, app_limit=True):
+        if not self.limited(resource, app_limit):
+            return
+        for limiter in (app_limit and self.limiter, self.get(resource)):
+            if limiter:
+                limiter.release()
+
+
+class WSGIApplication(object):
+    '''WSGI application serving resources
+    
+    Each application owns its resource table, host instances, response
+    cache and limits, so several can live in one process.
+    '''
     class ResponseFailure(Exception): pass
 
-    resources_manager = ResourceManager()
-    instances_manager = InstanceManager()
+    def __init__(self, resources=None, dispatch_cache_size=None,
+                 max_entity_length=None, response_cache_size=1024,
+                 response_cache_bytes=64 << 20, compress=False,
+                 compress_min_length=1024, metrics=False, metrics_path=None,
+                 batch_path=None, batch_workers=8, max_in_flight=None,
+                 max_queued=0, queue_timeout=0.5, retry_after=1,
+                 deadline_header='x-request-timeout', spool_size=1 << 20,
+                 max_part_length=None, pool_timeout=5.0):
+        self.resources_manager = ResourceManager()
+        self.instances_manager = InstanceManager()
+        self.cache_manager = CacheManager()
+        self.limits_manager = LimitManager()
+        self.resources_manager.init(resources, dispatch_cache_size)
+        self.cache_manager.init(response_cache_size, response_cache_bytes)
+        self.limits_manager.init(max_in_flight, max_queued, queue_timeout,
+                                 retry_after)
+        self.max_entity_length = max_entity_length
+        self.deadline_header = deadline_header
+        self.multipart = (spool_size, max_part_length)
+        self.compress = compress
+        self.compress_min_length = compress_min_length
+        self.metrics = Metrics() if metrics or metrics_path else None
+        if metrics_path:
+            self.resources_manager.add(
+                metrics_resource(self.metrics, metrics_path))
+        if batch_path:
+            self.resources_manager.add(
+                batch_resource(self, batch_path, batch_workers))
+        self.instances_manager.init(self.resources_manager.resources,
+                                    pool_timeout)
 
-    def __init__(self, resources=None):
-        WSGIApplication.resources_manager.init(resources)
-        WSGIApplication.instances_manager.init()
+    def reload(self, resources=None, wait=False):
+        '''Rebuild the resources in the background and swap them in
+        
+        resources replace the ones the application was built with, if
+        given. Singletons are built before the swap, cached responses are
+        dropped after. Returns the Thread doing it, None if wait.
+        '''
+        manager = self.resources_manager
+        def swap():
+            with manager.lock:
+                if resources is not None:
+                    manager.source = resources
+                tree = manager.build()
+                self.instances_manager.warm(tree)
+                manager.publish(tree)
+            self.cache_manager.invalidate()
+            self.limits_manager.retain(tree)
+        def run():
+            try:
+                swap()
+            except Exception:
+                _logger.critical(''.join(format_exception(*exc_info())))
+        if wait:
+            return swap()
+        thread = Thread(target=run, name='rs-reload', daemon=True)
+        thread.start()
+        return thread
 
     def complete_request(self, environ):
-        from rs.request import Request
-        from rs.message import parse_media, entity, uri
         request = Request()
         request.version = environ['SERVER_PROTOCOL']
         request.method = environ['REQUEST_METHOD']
         request.uri = uri(environ.get('PATH_INFO', '/'),
                           environ.get('QUERY_STRING', ''))
         
-        headers = [(k[5:].replace('_', '-').lower(), v)
-                    for k,v in environ.items() if k.startswith('HTTP_')]
-        headers.append(('content-length', environ.get('CONTENT_LENGTH', '')))
-        headers.append(('content-type', environ.get('CONTENT_TYPE', '')))
-        request.headers = dict(headers)
+        request.headers = EnvironHeaders(environ)
+        request.multipart = self.multipart
         
-        entity_len = int(request.headers['content-length'] or '0')
-        if entity_len:# TODO: charset always None and entity IS bytes  already 
-            charset = parse_media(request.headers.get('content-type')).charset
-
-            request.entity = entity(environ['wsgi.input'].read(entity_len),
-                                    charset)
+        entity_len = request.headers['content-length']
+        if entity_len:
+            if not (entity_len.isascii() and entity_len.isdigit()):
+                raise Error(BAD_REQUEST) #negative lengths would read all
+            entity_len = int(entity_len)
+        if entity_len:
+            request.stream = RequestEntity(environ['wsgi.input'], entity_len,
+                                           self.max_entity_length)
+        elif (environ.get('wsgi.input_terminated') and
+              not request.headers['content-length']): #chunked
+            request.stream = RequestEntity(environ['wsgi.input'], None,
+                                           self.max_entity_length)
         return request
 
     def complete_response(self, response, environ, start_response):
@@ -91,10 +475,16 @@ class WSGIApplication(object):
             entity=b''
             if (environ['REQUEST_METHOD'] != 'HEAD' and
                 response.entity is not None and
-                response.entity is not bytes and
                 response.status not in (NO_CONTENT,NOT_MODIFIED)):
                 
-                entity = response.entity.encode('utf-8')#TODO: ENCODING
+                if isinstance(response.entity, str):
+                    entity = response.entity.encode('utf-8')
+                elif is_stream(response.entity):
+                    entity = _stream(response.entity, environ)
+                else:
+                    entity = response.entity
+            elif is_stream(response.entity):
+                _close(response.entity)
                 
             status = '{status} {reason}'.format(
                 status=response.status,
@@ -104,49 +494,96 @@ class WSGIApplication(object):
         except Exception as e:
             raise WSGIApplication.ResponseFailure(e)
 
-        return _chunks(entity)
+        if isinstance(entity, bytes):
+            return [entity]
+        if isinstance(entity, (bytearray, memoryview)):
+            return [bytes(entity)] #copied once, PEP 3333 wants bytes
+        return entity
 
 
     def __call__(self, environ, start_response):
+        metrics, resource, request = self.metrics, None, None
+        started = perf_counter() if metrics else None
         try:
             request = self.complete_request(environ)
  
-            from rs.context import Context
-            with Context(self, request) as context:
-        
-                response = context.get_response()
+            context = Context(self, request)
+            try:
+                resource = context.resource
+                self.limits_manager.acquire(resource)
+                if metrics: metrics.enter(resource)
+                try:
+                    response = context.get_response()
+                finally:
+                    if metrics: metrics.leave(resource)
+                    self.limits_manager.release(resource)
                 
-                return self.complete_response(response,
-                                              environ,
+                body = self.complete_response(response, environ,
                                               start_response)
+            except BaseException:
+                context.close()
+                raise
+            if isinstance(body, list):
+                context.close()
+                if metrics:
+                    self.record(resource, response.status, started, request,
+                                _body_length(body))
+                return body
+            return _Body(body, partial(self.closed, context, resource,
+                                       response.status, started, request))
         except Error as e:
-            return self.complete_response(e, environ, start_response)
+            error = e
         except (IOError, WSGIApplication.ResponseFailure) as e:
             _logger.exception(e)
+            return []
         except Exception:
-            from traceback import format_exception
-            from sys import exc_info
             _logger.critical(''.join(format_exception(*exc_info())))
-            return self.complete_response(Error(INTERNAL_SERVER_ERROR),
-                                          environ, start_response)
-        return []
+            error = Error(INTERNAL_SERVER_ERROR)
+        body = self.complete_response(error, environ, start_response)
+        self.record(resource, error.status, started, request,
+                    _body_length(body))
+        return body
 
-    def run(self, host, port, make_server=None, debug=False):
+    def closed(self, context, resource, status, started, request, sent):
+        '''Finish a request once the server is done with its body
+        
+        '''
+        context.close()
+        self.record(resource, status, started, request, sent)
+
+    def record(self, resource, status, started, request=None, sent=0):
+        '''Record the metrics of a request, sent bytes of response body
+        
+        The latency runs until the body is sent, the request body length
+        is the bytes read when it has no Content-Length.
+        '''
+        if self.metrics is not None:
+            self.metrics.record(resource, status, perf_counter() - started,
+                                _request_length(request), sent)
+
+    def init_logging(self, debug=False):
+        if debug:
+            try: from rs.debug import debug as enable_debug
+            except ImportError: pass
+            else: enable_debug()
+        if not getLogger(__package__).handlers:
+            try: from rs.debug import basic_logging
+            except ImportError: pass
+            else:
+                from logging import INFO, DEBUG
+                basic_logging(DEBUG if debug else INFO)
+
+    def run(self, host, port, make_server=None, debug=False, workers=None):
         try:
-            if debug:
-                try: from rs.debug import debug as enable_debug
-                except ImportError: pass
-                else: enable_debug()
-            if not getLogger(__package__).handlers:
-                try: from rs.debug import basic_logging
-                except ImportError: pass
-                else:
-                    from logging import INFO, DEBUG
-                    basic_logging(DEBUG if debug else INFO)
+            self.init_logging(debug)
             if not make_server:
                 from wsgiref.simple_server import make_server
             server = make_server(host or '127.0.0.1', port, self)
             from contextlib import closing
             with closing(server.socket):
-                server.serve_forever()
+                if workers:
+                    from rs.prefork import serve
+                    serve(server, workers)
+                else:
+                    server.serve_forever()
         except (KeyboardInterrupt, SystemExit): pass
\ No newline at end of file
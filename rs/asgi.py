@@ -0,0 +1,269 @@
+import asyncio
+
+from concurrent.futures import ThreadPoolExecutor
+from inspect import iscoroutinefunction
+from logging import getLogger
+from time import perf_counter
+
+from rs.application import WSGIApplication
+from rs.context import Context
+from rs.core import POOLED
+from rs.error import Error
+from rs.status import INTERNAL_SERVER_ERROR
+
+
+__all__ = [
+    'ASGIApplication',
+]
+
+
+_logger = getLogger(__name__)
+
+
+class _ReceiveInput(object):
+    '''Blocking file-like reading the request body from ASGI receive()
+    
+    Read on the thread pool: each message is awaited on the event loop, so
+    the body is never buffered whole.
+    '''
+    def __init__(self, receive, loop, body, more_body):
+        self._receive = receive
+        self._loop = loop
+        self._chunk = body
+        self._offset = 0
+        self._more_body = more_body
+
+    def _next_chunk(self):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        else:
+            raise RuntimeError('the ASGI request body is read on the thread '
+                               'pool, not on the event loop')
+        message = asyncio.run_coroutine_threadsafe(self._receive(),
+                                                   self._loop).result()
+        if message['type'] == 'http.disconnect':
+            self._more_body = False
+            return b''
+        self._more_body = message.get('more_body', False)
+        return message.get('body', b'')
+
+    def read(self, size=-1):
+        chunks = []
+        while size:
+            if self._offset == len(self._chunk):
+                if not self._more_body:
+                    break
+                self._chunk, self._offset = self._next_chunk(), 0
+                continue
+            end = (len(self._chunk) if size < 0 else
+                   min(len(self._chunk), self._offset + size))
+            chunks.append(self._chunk[self._offset:end])
+            if size > 0:
+                size -= end - self._offset
+            self._offset = end
+        return chunks[0] if len(chunks) == 1 else b''.join(chunks)
+
+
+class ASGIApplication(WSGIApplication):
+    '''ASGI sibling of WSGIApplication
+
+    async def targets are awaited on the event loop, plain functions run
+    on a thread pool of max_workers. The other arguments, resources,
+    dispatching and parameter binding are those of WSGIApplication.
+
+    The request body is not buffered: it is received as the resource
+    reads it, dispatching and binding run on the thread pool when there is
+    one. async def targets must take it as an argument, not read it from
+    the request themselves.
+
+    run() serves it with uvicorn, which rs does not depend on, unless
+    make_server(host, port, app) builds another server to serve_forever().
+    '''
+    def __init__(self, *args, max_workers=None, **kwargs):
+        WSGIApplication.__init__(self, *args, **kwargs)
+        self.executor = ThreadPoolExecutor(max_workers)
+
+    async def complete_environ(self, scope, receive):
+        '''Build a WSGI like environ from the scope, reading the body lazily
+
+        '''
+        environ = {
+            'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+            'REQUEST_METHOD': scope['method'],
+            'PATH_INFO': scope.get('path', '/'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'CONTENT_TYPE': '',
+            'CONTENT_LENGTH': '',
+        }
+        for k, v in scope.get('headers', ()):
+            k = k.decode('latin-1').upper().replace('-', '_')
+            v = v.decode('latin-1')
+            if k in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                environ[k] = v
+            else:
+                environ['HTTP_' + k] = v
+        message = await receive() #empty for most requests without a body
+        body, more_body = b'', False
+        if message['type'] == 'http.request':
+            body = message.get('body', b'')
+            more_body = message.get('more_body', False)
+        environ['wsgi.input'] = _ReceiveInput(
+            receive, asyncio.get_running_loop(), body, more_body)
+        environ['wsgi.input_terminated'] = bool(body or more_body)
+        return environ
+
+    async def get_response(self, context):
+        loop = asyncio.get_running_loop()
+        if context.resource.validators: #user functions, querying storage
+            response = await loop.run_in_executor(self.executor,
+                                                  context.prepare_response)
+        else:
+            response = context.prepare_response()
+        if response is not None:
+            return response
+        if iscoroutinefunction(context.resource.target):
+            if not self.blocking_binder(context):
+                result = await context.invoke()
+            else:
+                result = await (await loop.run_in_executor(self.executor,
+                                                           context.invoke))
+        else:
+            result = await loop.run_in_executor(self.executor, context.invoke)
+        response = await loop.run_in_executor(self.executor,
+                                              context.complete_response,
+                                              result)
+        return await loop.run_in_executor(self.executor,
+                                          context.finish_response, response)
+
+    def blocking_binder(self, context):
+        '''Whether binding may block, reading the body or a pooled host
+        
+        '''
+        host = context.resource.host
+        return (context.request.stream is not None or
+                (host is not None and
+                 self.instances_manager.get_scope(host)[0] == POOLED))
+
+    async def send_response(self, response, environ, send):
+        '''Send the response, return the bytes of body sent
+        
+        '''
+        loop = asyncio.get_running_loop()
+        started, sent = {}, 0
+        def start_response(status, headers):
+            started['headers'] = [(k.encode('latin-1'), v.encode('latin-1'))
+                                  for k, v in headers]
+        entity = response.entity
+        if hasattr(entity, '__aiter__'):
+            response.entity = None
+        body = self.complete_response(response, environ, start_response)
+        await send({'type': 'http.response.start',
+                    'status': response.status,
+                    'headers': started['headers']})
+        if hasattr(entity, '__aiter__'):
+            if environ['REQUEST_METHOD'] != 'HEAD':
+                async for chunk in entity:
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode('utf-8')
+                    sent += len(chunk)
+                    await send({'type': 'http.response.body',
+                                'body': chunk, 'more_body': True})
+        elif isinstance(body, list):
+            for chunk in body:
+                sent += len(chunk)
+                await send({'type': 'http.response.body',
+                            'body': chunk, 'more_body': True})
+        else:
+            chunks = iter(body)
+            try:
+                while True:
+                    chunk = await loop.run_in_executor(self.executor,
+                                                       next, chunks, None)
+                    if chunk is None:
+                        break
+                    sent += len(chunk)
+                    await send({'type': 'http.response.body',
+                                'body': chunk, 'more_body': True})
+            finally:
+                if hasattr(body, 'close'):
+                    body.close()
+        await send({'type': 'http.response.body', 'body': b''})
+        return sent
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            raise ValueError('unsupported scope type: {0}'
+                             .format(scope['type']))
+        metrics, resource, request = self.metrics, None, None
+        started = perf_counter() if metrics else None
+        environ, sent = {'REQUEST_METHOD': scope['method']}, 0
+        loop, context = asyncio.get_running_loop(), None
+        try:
+            try:
+                environ = await self.complete_environ(scope, receive)
+                request = self.complete_request(environ)
+                if request.stream is None:
+                    context = Context(self, request)
+                else: #forms are read while dispatching
+                    context = await loop.run_in_executor(
+                        self.executor, Context, self, request)
+                resource = context.resource
+                limits = self.limits_manager
+                if limits.limited(resource): #waiting in the queue blocks
+                    await loop.run_in_executor(self.executor,
+                                               limits.acquire, resource)
+                if metrics: metrics.enter(resource)
+                try:
+                    response = await self.get_response(context)
+                finally:
+                    if metrics: metrics.leave(resource)
+                    limits.release(resource)
+            except Error as e:
+                response = e
+            except Exception:
+                _logger.exception('%s %s', scope['method'], scope.get('path'))
+                response = Error(INTERNAL_SERVER_ERROR)
+            try:
+                sent = await self.send_response(response, environ, send)
+            except (IOError, WSGIApplication.ResponseFailure) as e:
+                _logger.exception(e)
+        finally:
+            if context is not None: #a streamed body may use them until sent
+                context.close()
+        self.record(resource, response.status, started, request, sent)
+
+    def run(self, host, port, make_server=None, debug=False, workers=None):
+        '''Serve until interrupted, with workers forked processes if given
+        
+        '''
+        try:
+            self.init_logging(debug)
+            if make_server:
+                return make_server(host or '127.0.0.1', port,
+                                   self).serve_forever()
+            import uvicorn
+            config = uvicorn.Config(self, host=host or '127.0.0.1', port=port,
+                                    log_level='debug' if debug else 'info',
+                                    lifespan='on')
+            if not workers:
+                return uvicorn.Server(config).run()
+            from contextlib import closing
+            from rs.prefork import serve
+            with closing(config.bind_socket()) as socket:
+                serve(socket, workers, lambda socket: uvicorn.Server(
+                    config).run(sockets=[socket]))
+        except (KeyboardInterrupt, SystemExit): pass
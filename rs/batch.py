@@ -0,0 +1,199 @@
+import asyncio
+
+from concurrent.futures import ThreadPoolExecutor
+from inspect import iscoroutine
+from io import BytesIO
+from logging import getLogger
+from sys import exc_info
+from threading import Lock
+from traceback import format_exception
+
+from rs.context import Context
+from rs.core import RestDict, set_rest_dict
+from rs.error import Error
+from rs.message import (environ_key, parse_media, json_encoder,
+                        json_consumer)
+from rs.status import (BAD_REQUEST, INTERNAL_SERVER_ERROR,
+                       REQUEST_ENTITY_TOO_LARGE)
+
+
+__all__ = [
+    'Batch',
+    'batch_resource',
+]
+
+
+_logger = getLogger(__name__)
+
+_SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS') # may run concurrently
+
+# coded bodies can't be embedded in the JSON, not even asked by an item
+_CODINGS = ('HTTP_ACCEPT_ENCODING', 'HTTP_CONTENT_ENCODING')
+
+# environ keys of the batch request not inherited by its sub-requests
+_OMITTED = ('CONTENT_TYPE', 'CONTENT_LENGTH', 'wsgi.input',
+            'wsgi.input_terminated') + _CODINGS
+
+
+def _ignore(status, headers, exc_info=None):
+    pass
+
+
+class Batch(object):
+    '''Runs the sub-requests of a batch through an application
+    
+    A batch is a JSON list of {"method", "path", "headers", "body"} items,
+    only "path" is required. Sub-requests inherit the headers of the batch
+    request. Consecutive safe (GET, HEAD, OPTIONS) sub-requests run
+    concurrently on a bounded thread pool, the others alone and in order.
+    '''
+    def __init__(self, app, path, max_workers=8, max_items=100):
+        self.app = app
+        self.path = path
+        self.max_workers = max_workers
+        self.max_items = max_items
+        self._executor = None
+        self._lock = Lock()
+
+    @property
+    def executor(self):
+        #built on first use, so that prefork workers get their own threads
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(self.max_workers)
+        return self._executor
+
+    def run(self, request, items):
+        '''Return the (status, headers, body bytes) of the sub-requests
+        
+        '''
+        if not isinstance(items, list):
+            raise Error(BAD_REQUEST)
+        if len(items) > self.max_items:
+            raise Error(REQUEST_ENTITY_TOO_LARGE)
+        base = dict((k, v) for k, v in request.headers.environ.items()
+                    if k not in _OMITTED and not k.startswith('HTTP_IF_'))
+        environs = [self.environ(base, item) for item in items]
+        results, group = [], []
+        for environ in environs:
+            if environ['REQUEST_METHOD'] in _SAFE_METHODS:
+                group.append(environ)
+                continue
+            results.extend(self.map(group))
+            results.append(self.call(environ))
+            group = []
+        results.extend(self.map(group))
+        return results
+
+    def environ(self, base, item):
+        if not isinstance(item, dict) or not isinstance(item.get('path'), str):
+            raise Error(BAD_REQUEST)
+        headers = item.get('headers') or {}
+        if not isinstance(headers, dict):
+            raise Error(BAD_REQUEST)
+        environ = dict(base)
+        path, _, query = item['path'].partition('?')
+        environ['REQUEST_METHOD'] = str(item.get('method') or 'GET').upper()
+        environ['PATH_INFO'] = '/' + path.lstrip('/')
+        environ['QUERY_STRING'] = query
+        for k, v in headers.items():
+            k = environ_key(k)
+            if k not in _CODINGS:
+                environ[k] = str(v)
+        body = item.get('body')
+        if body is None:
+            body = b''
+        elif isinstance(body, str):
+            body = body.encode('utf-8')
+        else:
+            body = json_encoder().encode(body).encode('utf-8')
+            environ.setdefault('CONTENT_TYPE', 'application/json')
+        environ.setdefault('CONTENT_TYPE', '')
+        environ['CONTENT_LENGTH'] = str(len(body)) if body else ''
+        environ['wsgi.input'] = BytesIO(body)
+        return environ
+
+    def map(self, environs):
+        if len(environs) < 2:
+            return [self.call(environ) for environ in environs]
+        return list(self.executor.map(self.call, environs))
+
+    def call(self, environ):
+        '''Run a sub-request, return its (status, headers, body bytes)
+        
+        '''
+        app = self.app
+        try:
+            if environ['PATH_INFO'].rstrip('/') == self.path.rstrip('/'):
+                raise Error(BAD_REQUEST) #no nested batches
+            request = app.complete_request(environ)
+            with Context(app, request) as context:
+                #the batch request holds the slot of the application limit
+                app.limits_manager.acquire(context.resource, False)
+                try:
+                    response = self.get_response(context)
+                finally:
+                    app.limits_manager.release(context.resource, False)
+                body = b''.join(app.complete_response(response, environ,
+                                                      _ignore))
+        except Error as e:
+            response, body = e, b''
+        except Exception:
+            _logger.critical(''.join(format_exception(*exc_info())))
+            response, body = Error(INTERNAL_SERVER_ERROR), b''
+        return response.status, dict(response.headers), body
+
+    def get_response(self, context):
+        '''Get the response of a sub-request on the calling thread
+        
+        Coroutine targets run on a loop of their own: the thread pool of an
+        ASGIApplication may be all taken by batches waiting for this.
+        '''
+        response = context.prepare_response()
+        if response is None:
+            result = context.invoke()
+            if iscoroutine(result):
+                result = asyncio.run(result)
+            response = context.finish_response(
+                context.complete_response(result))
+        return response
+
+    def encode(self, results):
+        '''Encode the results as a JSON list of {status, headers, body}
+        
+        JSON bodies are embedded as is, other ones as strings.
+        '''
+        encode = json_encoder().encode
+        parts = []
+        for status, headers, body in results:
+            media = parse_media(headers.get('content-type') or
+                                'application/octet-stream')
+            if not body:
+                body = b'null'
+            elif not (media.value.endswith('/json') or
+                      media.value.endswith('+json')):
+                body = encode(body.decode(media.charset or 'utf-8',
+                                          'replace')).encode('utf-8')
+            parts.append(b''.join((
+                b'{"status":', str(status).encode('ascii'),
+                b',"headers":', encode(headers).encode('utf-8'),
+                b',"body":', body, b'}')))
+        return b'[' + b','.join(parts) + b']'
+
+
+def batch_resource(app, path='/_batch', max_workers=8, max_items=100):
+    '''Build a resource running batches of sub-requests through app
+    
+    It is not added to rs.core.registry, so only app serves it.
+    '''
+    from rs.resource import ResourceBuilder
+    batch = Batch(app, '/' + path.strip('/'), max_workers, max_items)
+    def batch_target(request=Context.request, entity=Context.entity):
+        return batch.run(request, entity)
+    set_rest_dict(batch_target, RestDict(
+        method='POST',
+        path=batch.path,
+        consumer=('application/json', json_consumer()),
+        producer=('application/json', batch.encode)))
+    return ResourceBuilder(batch_target).build()[0]
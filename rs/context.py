@@ -1,11 +1,24 @@
+from math import isfinite
+from time import monotonic
+
 from rs.response import Response
-from rs.status import OK, NO_CONTENT, BAD_REQUEST
+from rs.status import (OK, NO_CONTENT, NOT_MODIFIED, BAD_REQUEST,
+                       GATEWAY_TIMEOUT)
 from rs.error import Error
-from rs.message import set_entity, set_headers
+from rs.message import (set_entity, set_headers, is_stream, iter_chunks,
+                        entity_tag, etag_matches, http_date, parse_http_date,
+                        negotiate_encoding, compression_headers,
+                        compress_response)
+
+
+_VALIDATION_HEADERS = ('etag', 'last-modified', 'vary', 'cache-control',
+                       'expires', 'content-location')
 
 
 __all__ = [
     'Context',
+    'Deadline',
+    'make_binder',
 ]
 
 class context_property(property):
@@ -45,33 +58,302 @@ class application_property(property):
             del self.cache[context]
         
 
+_missing = object()
+
+
+class Deadline(object):
+    '''Time budget of a request
+    
+    expires is a time.monotonic() value, None if the budget is unbounded.
+    '''
+    __slots__ = ('expires',)
+
+    def __init__(self, expires=None):
+        self.expires = expires
+
+    @property
+    def remaining(self):
+        '''Seconds left, never negative, inf if unbounded
+        
+        '''
+        if self.expires is None:
+            return float('inf')
+        return max(self.expires - monotonic(), 0.0)
+
+    def expired(self):
+        return self.expires is not None and monotonic() >= self.expires
+
+    def check(self):
+        if self.expired():
+            raise Error(GATEWAY_TIMEOUT)
+
+    def stream(self, entity):
+        '''Wrap a streamed entity to check the deadline between chunks
+        
+        '''
+        if hasattr(entity, '__aiter__'):
+            return self._achunks(entity)
+        return self._chunks(entity)
+
+    def _chunks(self, entity):
+        chunks = iter_chunks(entity)
+        try:
+            for chunk in chunks:
+                self.check()
+                yield chunk
+        finally:
+            chunks.close()
+
+    async def _achunks(self, entity):
+        try:
+            async for chunk in entity:
+                self.check()
+                yield chunk
+        finally:
+            if hasattr(entity, 'aclose'):
+                await entity.aclose()
+
+
+_UNBOUNDED = Deadline()
+
+
+def request_deadline(timeout, header=None):
+    '''Return the Deadline of a request starting now, None if unbounded
+    
+    header, the seconds asked by the client, may only shorten timeout.
+    '''
+    if header:
+        try:
+            asked = float(header)
+        except ValueError:
+            asked = None
+        if asked is not None and isfinite(asked):
+            timeout = asked if timeout is None else min(timeout, asked)
+    if timeout is None:
+        return None
+    return Deadline(monotonic() + timeout)
+
+
+def make_binder(resource):
+    '''Build the function returning the target arguments of a Context
+
+    Where each argument comes from (host instance, context property, path,
+    query or form params, default) is decided here, once per resource.
+    '''
+    getters = []
+    path_args = resource.pattern.groupindex if resource.pattern else {}
+    for i, arg in enumerate(resource._fullargspec.args):
+        default = resource._args_defs.get(arg, _missing)
+        if i == 0 and resource.host:
+            getters.append((arg, _host_getter(resource.host)))
+        elif isinstance(default, context_property):
+            getters.append((arg, default.__get__))
+        elif arg in path_args:
+            getters.append((arg, _path_getter(arg)))
+        else:
+            getters.append((arg, _param_getter(arg, default)))
+    getters = tuple(getters)
+
+    def bind(context):
+        try:
+            return {arg: get(context) for arg, get in getters}
+        except ValueError:
+            raise Error(BAD_REQUEST)
+    return bind
+
+
+def _host_getter(host):
+    return lambda context: context.instances.get(host, context)
+
+
+def _path_getter(arg):
+    return lambda context: context._params['path'][arg]
+
+
+def _param_getter(arg, default):
+    def get(context):
+        params = context._params
+        query, form = params['query'], params['form']
+        if arg in query:
+            return query[arg]
+        if arg in form:
+            return form[arg]
+        if default is _missing:
+            raise Error(BAD_REQUEST)
+        return default
+    return get
+
+
 class Context(object):
 
+    __slots__ = ('_app', '_request', '_instances', '_validated', '_resource',
+                 '_params', '_deadline')
+
     def __init__(self, application, request):
         """
 
         """
         self._app = application
         self._request = request
+        self._instances = {} #instances of request and pooled scopes
+        self._validated = {} #headers computed by the resource validators
         
         resource, params =  application.resources_manager.get_resource(request)
         self._resource = resource
         self._params = params
+        header = application.deadline_header
+        self._deadline = request_deadline(
+            resource.deadline, header and request.headers.get(header))
         
     def __enter__(self):
         return self
 
     def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        '''Release the host instances and the spooled uploads
+        
+        Not before the response body is sent: a streamed one may use them.
+        '''
+        form = self._params.form
+        if hasattr(form, 'close'): #deletes the spooled uploads
+            form.close()
+        self.instances.release(self)
         del self.instances
         del self.resources
+        del self.caches
         
     def get_response(self):
-        result = self.resource.target(**dict(self.get_target_params()))
+        response = self.prepare_response()
+        if response is None:
+            response = self.finish_response(
+                self.complete_response(self.invoke()))
+        return response
+
+    def prepare_response(self):
+        '''Return the response when the target need not be invoked
+        
+        That is a cached response, already encoded, or 304 Not Modified,
+        else None.
+        '''
+        response = self.caches.get(self) or self.validate()
+        return response and self.check_conditions(response)
+
+    def finish_response(self, response):
+        if self._deadline is not None and is_stream(response.entity):
+            response.entity = self._deadline.stream(response.entity)
+        if response.status == OK:
+            set_headers(response, self._validated)
+            if (self.resource.etag and 'etag' not in response.headers and
+                response.entity is not None and
+                not is_stream(response.entity)):
+                response.headers['etag'] = entity_tag(
+                    response.entity, self.resource.etag == 'weak')
+        self.caches.vary(self, response)
+        response = self.check_conditions(response)
+        if response.status != NOT_MODIFIED:
+            response = self.encode_response(response)
+            self.caches.set(self, response) #cache hits are not reencoded
+        return response
+
+    def compressed(self):
+        return (self.resource.compress or
+                (self._app.compress and 'on')) == 'on'
+
+    def coding(self):
+        '''Return the coding negotiated to compress the response, else None
+        
+        '''
+        if not self.compressed():
+            return None
+        accept_encoding = self._request.headers.get('accept-encoding')
+        return accept_encoding and negotiate_encoding(accept_encoding) or None
+
+    def encode_response(self, response):
+        '''Compress the response as negotiated by Accept-Encoding
+        
+        '''
+        if (not self.compressed() or
+            response.status in (NO_CONTENT, NOT_MODIFIED)):
+            return response
+        return compress_response(response,
+                                 self._request.headers.get('accept-encoding'),
+                                 self._app.compress_min_length)
+
+    def encode_not_modified(self, not_modified, media):
+        '''Give a 304 the Vary and ETag its 200 of media gets compressed
+        
+        '''
+        if self.compressed():
+            compression_headers(not_modified.headers, media,
+                                self._request.headers.get('accept-encoding'))
+        return not_modified
+
+    def validate(self):
+        if not self.resource.validators:
+            return None
+        etag, last_modified = self.resource.validators
+        tag = etag and etag(self)
+        if tag:
+            self._validated['etag'] = (tag if tag.endswith('"')
+                                       else '"{0}"'.format(tag))
+        modified = last_modified and last_modified(self)
+        if modified:
+            self._validated['last-modified'] = http_date(modified)
+        response = Response(OK)
+        response.headers.update(self._validated)
+        response = self.check_conditions(response)
+        if response.status != NOT_MODIFIED:
+            return None
+        return self.encode_not_modified(
+            response, self.resource._produces or 'application/octet-stream')
+
+    def check_conditions(self, response):
+        '''Replace the response by 304 Not Modified if the client's is fresh
+        
+        '''
+        headers = self._request.headers
+        if (response.status != OK or
+            self._request.method not in ('GET', 'HEAD')):
+            return response
+        if_none_match = headers.get('if-none-match')
+        if if_none_match:
+            etag = response.headers.get('etag')
+            if not etag or not etag_matches(if_none_match, etag):
+                return response
+        else:
+            since = headers.get('if-modified-since')
+            modified = response.headers.get('last-modified')
+            if not since or not modified:
+                return response
+            since, modified = parse_http_date(since), parse_http_date(modified)
+            if since is None or modified is None or modified > since:
+                return response
+        if is_stream(response.entity) and hasattr(response.entity, 'close'):
+            response.entity.close()
+        not_modified = Response(NOT_MODIFIED)
+        for k in _VALIDATION_HEADERS:
+            if k in response.headers:
+                not_modified.headers[k] = response.headers[k]
+        if (response.entity is None or
+            'content-encoding' in response.headers or
+            hasattr(response.entity, '__aiter__')):
+            return not_modified
+        return self.encode_not_modified(
+            not_modified, response.headers.get('content-type', ''))
+
+    def invoke(self):
+        if self._deadline is not None:
+            self._deadline.check()
+        return self.resource.target(**self.resource._binder(self))
+
+    def complete_response(self, result):
         if result is None:
             response = Response(NO_CONTENT)
         elif isinstance(result, tuple):
             response = self.make_response(*result)
-        elif not isinstance(result, Response):
+        elif not isinstance(result, (Response, Error)):
             response = self.make_response(result)
         else:
             response = result
@@ -89,24 +371,7 @@ class Context(object):
         return response
 
     def get_target_params(self):
-        for i, arg in enumerate(self.resource._fullargspec.args):
-            try:
-                if i == 0 and self.resource.host:
-                    yield arg, self.instances[self.resource.host] #call instances
-                elif isinstance(self.resource._args_defs.get(arg), context_property):
-                    yield arg, self.resource._args_defs[arg].__get__(self)
-                elif arg in self.params.path:
-                    yield arg, self.params.path[arg]
-                elif arg in self.params.query:
-                    yield arg, self.params.query[arg]
-                elif arg in self.params.form:
-                    yield arg, self.params.form[arg]
-                elif arg in self.resource._args_defs:
-                    yield arg, self.resource._args_defs[arg]
-                else:
-                    raise Error(BAD_REQUEST)
-            except ValueError:
-                raise Error(BAD_REQUEST)
+        return iter(self.resource._binder(self).items())
 
     @context_property
     def entity(self):
@@ -117,6 +382,14 @@ class Context(object):
                 entity = consume(entity)
         return entity
 
+    @context_property
+    def stream(self):
+        return self._request.stream
+
+    @context_property
+    def deadline(self):
+        return self._deadline or _UNBOUNDED
+
     @context_property
     def request(self):
         return self._request
@@ -141,6 +414,10 @@ class Context(object):
     def resources(self):
         return self._app.resources_manager #TODO: MAYBE CHANGED
 
+    @application_property
+    def caches(self):
+        return self._app.cache_manager
+
     @application_property
     def instances(self):
         return self._app.instances_manager  #_app is application
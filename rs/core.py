@@ -13,12 +13,29 @@ __all__ = [
     'post',
     'put',
     'delete',
+    'scope',
+    'cache',
+    'etag',
+    'validators',
+    'compress',
+    'limit',
+    'deadline',
+    'SINGLETON',
+    'THREAD',
+    'REQUEST',
+    'POOLED',
 ]
 
 
 encoding = 'utf-8' # default encoding.
 registry = set()   # set of registered resources.
 
+# lifecycle scopes of resource hosts
+SINGLETON = 'singleton' # one instance, built at startup
+THREAD    = 'thread'    # one instance per thread
+REQUEST   = 'request'   # a new instance per request
+POOLED    = 'pooled'    # borrowed from a bounded pool for a request
+
 
 get_rest_dict = lambda o: getattr(o, '__rest_dict__')
 set_rest_dict = lambda o, v: setattr(o, '__rest_dict__', v)
@@ -83,6 +100,88 @@ def consumes(media, consumer=None):
     return consumes_actual
 
 
+def scope(name, size=None):
+    if name not in (SINGLETON, THREAD, REQUEST, POOLED):
+        raise ValueError('unexpected scope specified: {0}'.format(name))
+    if name == POOLED and not size:
+        raise ValueError('size of the pool must be specified')
+    @rest_api
+    def scope_actual(rest_dict):
+        rest_dict.scope = name, size
+    return scope_actual
+
+
+def cache(ttl=None, vary=()):
+    '''Cache encoded GET responses for ttl seconds (forever if None)
+    
+    Responses are keyed on the path and query params, the produced media
+    and the values of the request headers named in vary.
+    '''
+    @rest_api
+    def cache_actual(rest_dict):
+        rest_dict.cache = ttl, tuple(h.lower() for h in vary)
+    return cache_actual
+
+
+def etag(weak=False):
+    '''Tag encoded responses with an ETag computed from their content
+    
+    '''
+    @rest_api
+    def etag_actual(rest_dict):
+        rest_dict.etag = 'weak' if weak else 'strong'
+    return etag_actual
+
+
+def validators(etag=None, last_modified=None):
+    '''Validators called with the Context before the target is invoked
+    
+    etag returns the current ETag, last_modified a datetime or timestamp. 
+    If the request is conditional and they match, the target is not invoked
+    and the response is 304 Not Modified.
+    '''
+    @rest_api
+    def validators_actual(rest_dict):
+        rest_dict.validators = etag, last_modified
+    return validators_actual
+
+
+def compress(enabled=True):
+    '''Enable or disable compression of the responses of a resource
+    
+    '''
+    @rest_api
+    def compress_actual(rest_dict):
+        rest_dict.compress = 'on' if enabled else 'off'
+    return compress_actual
+
+
+def limit(max_in_flight, queue=0, timeout=0.5, retry_after=1):
+    '''Bound the requests of a resource in flight
+    
+    Up to queue requests wait at most timeout seconds for a slot, the
+    others are answered 503 Service Unavailable with Retry-After at once.
+    '''
+    if max_in_flight < 1:
+        raise ValueError('max_in_flight must be positive')
+    @rest_api
+    def limit_actual(rest_dict):
+        rest_dict.limit = max_in_flight, queue, timeout, retry_after
+    return limit_actual
+
+
+def deadline(seconds):
+    '''Answer 504 Gateway Timeout when a request outlives seconds
+    
+    Checked before the target is invoked and between streamed chunks. 
+    Clients may shorten it with the deadline header of the application.
+    '''
+    @rest_api
+    def deadline_actual(rest_dict):
+        rest_dict.deadline = seconds
+    return deadline_actual
+
+
 get     = method('GET')
 post    = method('POST')
 put     = method('PUT')
@@ -10,6 +10,7 @@ __all__ = [
     'debug',
     'conditional',
     'profiling',
+    'Profiler',
     'log_return',
     'log_params',
     'log_exception',
@@ -31,7 +32,7 @@ def basic_logging(level=logging.INFO):
     return logger
 
 
-def debug():
+def debug(profiler=None):
     logger = logging.getLogger(__name__)
     from rs.request import Request as req
     from rs.response import Response as resp
@@ -51,7 +52,7 @@ def debug():
     )
     __del__ = lambda self: logger.debug('%r deleted.', self)
     req.__del__ = resp.__del__ = rsrc.__del__ = ctx.__del__ = __del__
-    app.__call__ = profiling(app.__call__)
+    app.__call__ = (profiler or Profiler(every=100, interval=60))(app.__call__)
 
     
 def profiling(func):
@@ -65,6 +66,96 @@ def profiling(func):
         return returned
     return wrapped
 
+
+class Profiler(object):
+    '''Profile a sample of the requests and accumulate their stats
+
+    Decorates WSGIApplication.__call__. One request in every is profiled,
+    as long as profiling takes less than budget (a fraction of the wall
+    time) if given. resources limits profiling to the requests whose path
+    matches one of the given targets or path templates. The merged stats
+    are written by dump(), and every interval seconds if given: to
+    filename (pstats format) or else printed.
+    '''
+    def __init__(self, every=100, budget=None, resources=None,
+                 filename=None, interval=None, sort=('cumulative', 'calls')):
+        import threading, time
+        self.every = every
+        self.budget = budget
+        self.resources = set(resources) if resources else None
+        self.filename = filename
+        self.interval = interval
+        self.sort = sort
+        self.stats = None
+        self.requests = self.profiled = 0
+        self.profiled_time = 0.0
+        self._time = time.time
+        self._started = self._dumped = time.time()
+        self._lock = threading.Lock() # held while a request is profiled
+        self._stats_lock = threading.Lock()
+
+    def __call__(self, func):
+        @wraps(func)
+        def wrapped(*args, **kwargs):
+            self.requests += 1
+            if not self.sampled(*args) or not self._lock.acquire(False):
+                return func(*args, **kwargs)
+            import cProfile
+            try:
+                profile = cProfile.Profile()
+                started = self._time()
+                returned = profile.runcall(func, *args, **kwargs)
+                self.profiled_time += self._time() - started
+            finally:
+                self._lock.release()
+            self.add(profile)
+            return returned
+        return wrapped
+
+    def sampled(self, app=None, environ=None, *args):
+        if self.requests % self.every:
+            return False
+        if (self.budget is not None and self.profiled_time >
+            self.budget * (self._time() - self._started)):
+            return False
+        if self.resources is not None and environ is not None:
+            resources = app.resources_manager.resources
+            return any(res.target in self.resources or
+                       res.path in self.resources
+                       for res, params in resources.match(
+                           environ.get('PATH_INFO', '/')))
+        return True
+
+    def add(self, profile):
+        import pstats
+        with self._stats_lock:
+            if self.stats is None:
+                self.stats = pstats.Stats(profile)
+            else:
+                self.stats.add(profile)
+            self.profiled += 1
+        if self.interval and self._time() - self._dumped >= self.interval:
+            self.dump()
+
+    def dump(self, filename=None):
+        filename = filename or self.filename
+        with self._stats_lock:
+            self._dumped = self._time()
+            if self.stats is None:
+                return
+            if filename:
+                self.stats.dump_stats(filename)
+            else:
+                import pstats
+                stats = pstats.Stats() # strip_dirs() must not alter self.stats
+                stats.add(self.stats)
+                stats.strip_dirs().sort_stats(*self.sort).print_stats()
+
+    def reset(self):
+        with self._stats_lock:
+            self.stats = None
+            self.profiled = 0
+
     
 def conditional(condition, decorator):
     return lambda func: decorator(func) if condition else func
@@ -8,5 +8,14 @@ __all__ = [
 ]
 
 
-class Error(Response, Exception):
-    pass
\ No newline at end of file
+class Error(Exception):
+    '''Response raised as an exception
+
+    Not a subclass of Response, since the slots of Response cannot be laid
+    out together with those of Exception; check for (Response, Error).
+    '''
+    __slots__ = ('status', 'headers', 'entity')
+
+    def __init__(self, status=None):
+        Exception.__init__(self, status)
+        Response.__init__(self, status)
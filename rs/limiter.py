@@ -0,0 +1,50 @@
+from threading import Condition
+
+
+__all__ = [
+    'Limiter',
+]
+
+
+class Limiter(object):
+    '''Bounds the number of requests in flight
+    
+    Up to queue requests wait at most timeout seconds (forever if None) for
+    a slot, the others are refused at once.
+    '''
+    def __init__(self, limit, queue=0, timeout=None, retry_after=1):
+        self.limit = limit
+        self.queue = queue
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.in_flight = self.waiting = 0
+        self.rejected = 0
+        self._condition = Condition()
+
+    def acquire(self):
+        '''Return True when a slot was taken, False when refused
+        
+        '''
+        with self._condition:
+            if self.in_flight < self.limit:
+                self.in_flight += 1
+                return True
+            if self.waiting >= self.queue:
+                self.rejected += 1
+                return False
+            self.waiting += 1
+            try:
+                acquired = self._condition.wait_for(
+                    lambda: self.in_flight < self.limit, self.timeout)
+            finally:
+                self.waiting -= 1
+            if acquired:
+                self.in_flight += 1
+            else:
+                self.rejected += 1
+            return acquired
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
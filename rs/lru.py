@@ -0,0 +1,83 @@
+from collections import OrderedDict, namedtuple
+from threading import Lock
+
+
+__all__ = [
+    'LRUCache',
+]
+
+
+cache_info = namedtuple('cache_info', 'hits, misses, maxsize, currsize')
+
+_missing = object()
+
+
+class LRUCache(object):
+    '''Bounded, thread safe mapping evicting the least recently used keys
+    
+    Optionally bounded by the total weight of the values too, weigh being
+    the function returning the weight of a value.
+    '''
+    def __init__(self, maxsize=128, maxweight=None, weigh=None):
+        self.maxsize = maxsize
+        self.maxweight = maxweight
+        self.weigh = weigh
+        self.weight = 0
+        self.hits = self.misses = 0
+        self._data = OrderedDict()
+        self._weights = {}
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def keys(self):
+        with self._lock:
+            return list(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._data.get(key, _missing)
+            if value is _missing:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        weight = self.weigh(value) if self.weigh else 0
+        if self.maxweight is not None and weight > self.maxweight:
+            return self.discard(key)
+        with self._lock:
+            self._pop(key)
+            self._data[key] = value
+            self._weights[key] = weight
+            self.weight += weight
+            while (len(self._data) > self.maxsize or
+                   (self.maxweight is not None and
+                    self.weight > self.maxweight)):
+                self._pop(next(iter(self._data)))
+
+    def discard(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._weights.clear()
+            self.weight = 0
+            self.hits = self.misses = 0
+
+    def info(self):
+        return cache_info(self.hits, self.misses, self.maxsize,
+                          len(self._data))
+
+    def _pop(self, key):
+        if key in self._data:
+            del self._data[key]
+            self.weight -= self._weights.pop(key)
@@ -1,25 +1,128 @@
 
 
 
+import re
+
+from json import JSONDecoder, JSONEncoder, detect_encoding
 from collections import namedtuple
+from collections.abc import Mapping
+from datetime import timezone
+from email.utils import formatdate, parsedate_to_datetime
+from functools import lru_cache
+from hashlib import blake2b
+from os import fstat
+from stat import S_ISREG
+from zlib import compressobj, DEFLATED, MAX_WBITS
 
 from rs.core import RestDict, encoding as default_encoding
+from rs.error import Error
+from rs.status import BAD_REQUEST
 
 
 __all__ = [
     'uri',
+    'EnvironHeaders',
     'entity',
+    'is_stream',
+    'iter_chunks',
+    'stream_length',
     'set_headers',
     'set_entity',
     'parse_header',
     'parse_media',
     'parse_accept',
+    'media_pattern',
+    'accept_quality',
+    'entity_tag',
+    'etag_matches',
+    'http_date',
+    'parse_http_date',
+    'negotiate_encoding',
+    'compression_headers',
+    'compress_response',
+    'json_encoder',
+    'json_producer',
+    'json_consumer',
 ]
 
 
+_PARSE_CACHE_SIZE = 256 # parsed media/accept values are shared, do not modify
+
+CHUNK_LENGTH = 8192 # bytes read at once from streamed entities
+
+_CODINGS = ('gzip', 'deflate') # supported content codings, preferred first
+
+_COMPRESSED_MEDIA = re.compile(r'''^(?:(?:image|audio|video)/(?!svg)
+                                   |application/(?:zip|gzip|x-gzip
+                                                   |x-bzip2|x-xz|zstd
+                                                   |x-7z-compressed|pdf)
+                                   |font/woff)''', re.VERBOSE)
+
+
 uri = namedtuple('uri', 'path, query')
 
 
+_UNPREFIXED = ('CONTENT_TYPE', 'CONTENT_LENGTH') # environ keys without HTTP_
+
+
+@lru_cache(maxsize=_PARSE_CACHE_SIZE)
+def environ_key(name):
+    key = name.upper().replace('-', '_')
+    return key if key in _UNPREFIXED else 'HTTP_' + key
+
+
+class EnvironHeaders(Mapping):
+    '''Case insensitive, read only view of the headers of a WSGI environ
+    
+    Names are translated on access, e.g. 'accept' reads HTTP_ACCEPT. The
+    lowercased dict of all headers is only built to iterate.
+    '''
+    __slots__ = ('_environ', '_headers')
+
+    def __init__(self, environ):
+        self._environ = environ
+        self._headers = None
+
+    def __getitem__(self, name):
+        key = environ_key(name)
+        if key in _UNPREFIXED:
+            return self._environ.get(key, '')
+        return self._environ[key]
+
+    def get(self, name, default=None):
+        key = environ_key(name)
+        if key in _UNPREFIXED:
+            return self._environ.get(key, '')
+        return self._environ.get(key, default)
+
+    def __contains__(self, name):
+        return environ_key(name) in _UNPREFIXED or \
+               environ_key(name) in self._environ
+
+    def __iter__(self):
+        return iter(self.materialize())
+
+    def __len__(self):
+        return len(self.materialize())
+
+    def __repr__(self):
+        return repr(self.materialize())
+
+    @property
+    def environ(self):
+        return self._environ
+
+    def materialize(self):
+        if self._headers is None:
+            headers = dict((k[5:].replace('_', '-').lower(), v)
+                           for k, v in self._environ.items()
+                           if k.startswith('HTTP_'))
+            headers['content-length'] = self._environ.get('CONTENT_LENGTH', '')
+            headers['content-type'] = self._environ.get('CONTENT_TYPE', '')
+            self._headers = headers
+        return self._headers
+
+
 def entity(entity, encoding=None):
     encoding = encoding or default_encoding
     try:
@@ -31,6 +134,46 @@ def entity(entity, encoding=None):
         return entity
 
 
+def is_stream(entity):
+    '''True for file objects, iterators and async iterables of chunks
+    
+    Other values, lists and dicts among them, are not streamed: they are
+    encoded whole, so that an error is raised before the headers are sent.
+    '''
+    return (hasattr(entity, 'read') or hasattr(entity, '__next__') or
+            hasattr(entity, '__aiter__'))
+
+
+def iter_chunks(entity, size=CHUNK_LENGTH, encoding=None):
+    '''Yield the chunks of a file object or iterable, then close it
+    
+    str chunks are encoded if encoding is given.
+    '''
+    chunks = (iter(lambda: entity.read(size), entity.read(0))
+              if hasattr(entity, 'read') else entity)
+    try:
+        for chunk in chunks:
+            if encoding and isinstance(chunk, str):
+                chunk = chunk.encode(encoding)
+            yield chunk
+    finally:
+        if hasattr(entity, 'close'):
+            entity.close()
+
+
+def stream_length(entity):
+    '''Remaining length of a regular file object, None if unknown
+    
+    '''
+    try:
+        st = fstat(entity.fileno())
+        if 'b' in getattr(entity, 'mode', 'b') and S_ISREG(st.st_mode):
+            return st.st_size - entity.tell()
+    except (AttributeError, OSError, ValueError):
+        pass
+    return None
+
+
 def set_headers(message, headers):
     if headers:
         for k,v in headers.items(): # items() is used due to rfc822.Message compatibility
@@ -40,13 +183,25 @@ def set_headers(message, headers):
 def set_entity(message, entity_, media=None):
     #message -> Response
     if entity_ is not None:
-        media = parse_media(media or 'application\octet-stream')
+        media = parse_media(media or 'application/octet-stream')
         message.headers['content-type'] = \
         media.header if media.charset else combine_header(media.value,
                                                           ('charset',
                                                            default_encoding))
-        message.headers['content-length'] = str(len(entity_))
-        message.entity = entity(entity_, media.charset or default_encoding)
+        if is_stream(entity_):
+            length = stream_length(entity_)
+            if length is not None:
+                message.headers['content-length'] = str(length)
+            message.entity = entity_
+            return
+        if isinstance(entity_, str):
+            entity_ = entity_.encode(media.charset or default_encoding)
+        elif not isinstance(entity_, (bytes, bytearray, memoryview)):
+            entity_ = str(entity_).encode(media.charset or default_encoding)
+        message.headers['content-length'] = str(
+            entity_.nbytes if isinstance(entity_, memoryview) else
+            len(entity_))
+        message.entity = entity_
 
 
 def parse_header(header):
@@ -57,17 +212,230 @@ def parse_header(header):
     return RestDict(parsed)
 
 
+@lru_cache(maxsize=_PARSE_CACHE_SIZE)
 def parse_media(media, _parser=parse_header):
     parsed = _parser(media)
     parsed.update(zip(('type', 'subtype'), parsed.value.strip().split('/')))
     return parsed
 
 
+@lru_cache(maxsize=_PARSE_CACHE_SIZE)
 def parse_accept(accept, _parser=parse_media):
     def sort_key(p):
         return float(p.q) if p.q else 1.0, len(p.value), len(p)
     parsed = map(_parser, accept.split(','))
-    return sorted(parsed, key=sort_key, reverse=True)
+    return tuple(sorted(parsed, key=sort_key, reverse=True))
+
+
+@lru_cache(maxsize=_PARSE_CACHE_SIZE)
+def media_pattern(value):
+    '''Compile a media range such as 'text/*' to a regex matching media types
+    
+    '''
+    return re.compile(re.escape(value).replace(r'\*', '.*'))
+
+
+@lru_cache(maxsize=_PARSE_CACHE_SIZE)
+def accept_quality(accept, media):
+    '''Return the q value of the first accepted media matching media, or None
+    
+    '''
+    for accepted in parse_accept(accept):
+        if media_pattern(accepted.value).match(media):
+            return float(accepted.q) if accepted.q else 1.0
+    return None
+
+
+def entity_tag(entity, weak=False):
+    '''Quoted ETag computed from the content of an entity
+    
+    str entities are hashed UTF-8 encoded, as they are sent.
+    '''
+    if isinstance(entity, str):
+        entity = entity.encode('utf-8')
+    tag = '"{0}"'.format(blake2b(entity, digest_size=16).hexdigest())
+    return 'W/' + tag if weak else tag
+
+
+def etag_matches(if_none_match, etag):
+    '''Weak comparison of etag with an If-None-Match header
+    
+    '''
+    if if_none_match.strip() == '*':
+        return True
+    strip = lambda tag: tag.strip()[2:] if tag.strip().startswith('W/') \
+                        else tag.strip()
+    return strip(etag) in [strip(tag) for tag in if_none_match.split(',')]
+
+
+def http_date(value):
+    '''Format a timestamp or a datetime (naive meaning UTC) as an HTTP date
+    
+    '''
+    if hasattr(value, 'timestamp'):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        value = value.timestamp()
+    return formatdate(value, usegmt=True)
+
+
+def parse_http_date(value):
+    '''Timestamp of an HTTP date, None if it is invalid
+    
+    '''
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+@lru_cache(maxsize=_PARSE_CACHE_SIZE)
+def negotiate_encoding(accept_encoding):
+    '''Preferred supported content coding of an Accept-Encoding header
+    
+    None means identity, i.e. no compression.
+    '''
+    qualities = {}
+    for accepted in parse_accept(accept_encoding):
+        qualities.setdefault(accepted.value.lower(),
+                             float(accepted.q) if accepted.q else 1.0)
+    best, best_q = None, 0
+    for coding in _CODINGS:
+        q = qualities.get(coding, qualities.get('*', 0))
+        if q > best_q:
+            best, best_q = coding, q
+    if qualities.get('identity', 0) > best_q:
+        return None
+    return best
+
+
+def compression_headers(headers, media, accept_encoding):
+    '''Set the headers compress_response gives the responses of media
+    
+    That is Vary and, when a coding is negotiated, a weak ETag, whether or
+    not the entity turns out long enough to be compressed, so that a 304 Not
+    Modified gets the same. Return the coding, None if not compressed.
+    '''
+    if _COMPRESSED_MEDIA.match(media.lower()):
+        return None
+    vary = headers.get('vary')
+    if not vary:
+        headers['vary'] = 'accept-encoding'
+    elif 'accept-encoding' not in vary.lower():
+        headers['vary'] = vary + ', accept-encoding'
+    coding = accept_encoding and negotiate_encoding(accept_encoding)
+    etag = headers.get('etag')
+    if coding and etag and not etag.startswith('W/'): #the bytes sent differ
+        headers['etag'] = 'W/' + etag
+    return coding
+
+
+def compress_response(response, accept_encoding, min_length=0, level=6):
+    '''Compress the entity of the response with the negotiated coding
+    
+    Streamed entities are compressed chunk by chunk while they are sent.
+    '''
+    if (response.entity is None or 'content-encoding' in response.headers or
+        hasattr(response.entity, '__aiter__')):
+        return response
+    coding = compression_headers(response.headers,
+                                 response.headers.get('content-type', ''),
+                                 accept_encoding)
+    if not coding:
+        return response
+    compressor = compressobj(level, DEFLATED,
+                             MAX_WBITS | 16 if coding == 'gzip' else MAX_WBITS)
+    if is_stream(response.entity):
+        response.entity = _compress_chunks(response.entity, compressor)
+        response.headers.pop('content-length', None)
+    else:
+        if len(response.entity) < min_length:
+            return response
+        response.entity = (compressor.compress(response.entity) +
+                           compressor.flush())
+        response.headers['content-length'] = str(len(response.entity))
+    response.headers['content-encoding'] = coding
+    return response
+
+
+def _compress_chunks(entity, compressor):
+    chunks = iter_chunks(entity, encoding=default_encoding)
+    try:
+        for chunk in chunks:
+            chunk = compressor.compress(chunk)
+            if chunk:
+                yield chunk
+        yield compressor.flush()
+    finally:
+        chunks.close()
+
+
+@lru_cache(maxsize=None)
+def _json_encoder(options):
+    return JSONEncoder(**dict(options))
+
+
+def json_encoder(**options):
+    '''Shared JSONEncoder of the given json.dumps options
+    
+    '''
+    return _json_encoder(tuple(sorted(options.items())))
+
+
+def json_producer(stream=False, **options):
+    '''Return a producer encoding entities to UTF-8 JSON bytes
+    
+    Iterators and generators are streamed as a JSON array element by
+    element, lists, tuples and dicts too if stream is true.
+    '''
+    encoder = json_encoder(**options)
+    encode = encoder.encode
+    def json_produce(entity):
+        if hasattr(entity, '__next__') or (
+                stream and isinstance(entity, (list, tuple))):
+            return _join_chunks(_json_array(entity, encode))
+        if stream and isinstance(entity, dict):
+            return _join_chunks(encoder.iterencode(entity))
+        return encode(entity).encode('utf-8')
+    return json_produce
+
+
+def json_consumer(**options):
+    '''Return a consumer decoding JSON entities, 400 if they are invalid
+    
+    '''
+    decode = JSONDecoder(**options).decode
+    def json_consume(entity):
+        try:
+            if not isinstance(entity, str):
+                entity = bytes(entity).decode(detect_encoding(entity))
+            return decode(entity)
+        except ValueError:
+            raise Error(BAD_REQUEST)
+    return json_consume
+
+
+def _json_array(items, encode):
+    separator = '['
+    for item in items:
+        yield separator + encode(item)
+        separator = ','
+    yield '[]' if separator == '[' else ']'
+
+
+def _join_chunks(strings):
+    '''Join small str pieces into UTF-8 chunks of about CHUNK_LENGTH
+    
+    '''
+    buffer, length = [], 0
+    for string in strings:
+        buffer.append(string)
+        length += len(string)
+        if length >= CHUNK_LENGTH:
+            yield ''.join(buffer).encode('utf-8')
+            buffer, length = [], 0
+    if buffer:
+        yield ''.join(buffer).encode('utf-8')
 
 
 def combine_header(value, *params):
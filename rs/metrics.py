@@ -0,0 +1,184 @@
+from bisect import bisect_left
+from itertools import count
+from threading import Lock, local
+
+from rs.core import RestDict, set_rest_dict
+
+
+__all__ = [
+    'Metrics',
+    'metrics_resource',
+]
+
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_STRIPES = 16 # number of independently locked shards of the counters
+
+UNMATCHED = ('', '') # key of the requests no resource was found for
+
+
+class _Stats(object):
+    __slots__ = ('count', 'statuses', 'in_flight', 'request_bytes',
+                 'response_bytes', 'buckets', 'latency')
+
+    def __init__(self, buckets):
+        self.count = self.in_flight = 0
+        self.request_bytes = self.response_bytes = 0
+        self.latency = 0.0
+        self.statuses = {}
+        self.buckets = [0] * (len(buckets) + 1) #the last one is +Inf
+
+    def merge(self, other):
+        self.count += other.count
+        self.in_flight += other.in_flight
+        self.request_bytes += other.request_bytes
+        self.response_bytes += other.response_bytes
+        self.latency += other.latency
+        for status, count in other.statuses.items():
+            self.statuses[status] = self.statuses.get(status, 0) + count
+        self.buckets = [a + b for a, b in zip(self.buckets, other.buckets)]
+
+
+class Metrics(object):
+    '''Per resource counters and latency histograms
+
+    Counters are kept in locked shards handed out to threads in turn, so
+    threads seldom contend, and merged when a snapshot is taken.
+    '''
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self._stripes = [(Lock(), {}) for _ in range(_STRIPES)]
+        self._local = local()
+        self._turn = count() #thread idents are aligned, bad to stripe by
+
+    def _stripe(self):
+        try:
+            return self._local.stripe
+        except AttributeError:
+            stripe = self._stripes[next(self._turn) % _STRIPES]
+            self._local.stripe = stripe
+            return stripe
+
+    def key(self, resource):
+        return (resource.method, resource.path) if resource else UNMATCHED
+
+    def _stats(self, stats, key):
+        if key not in stats:
+            stats[key] = _Stats(self.buckets)
+        return stats[key]
+
+    def enter(self, resource):
+        lock, stats = self._stripe()
+        with lock:
+            self._stats(stats, self.key(resource)).in_flight += 1
+
+    def leave(self, resource):
+        lock, stats = self._stripe()
+        with lock:
+            self._stats(stats, self.key(resource)).in_flight -= 1
+
+    def record(self, resource, status, latency, request_bytes=0,
+               response_bytes=0):
+        index = bisect_left(self.buckets, latency)
+        lock, stats = self._stripe()
+        with lock:
+            s = self._stats(stats, self.key(resource))
+            s.count += 1
+            s.statuses[status] = s.statuses.get(status, 0) + 1
+            s.request_bytes += request_bytes
+            s.response_bytes += response_bytes
+            s.latency += latency
+            s.buckets[index] += 1
+
+    def snapshot(self):
+        '''Return {(method, path): RestDict of the merged counters}
+
+        '''
+        merged = {}
+        for lock, stats in self._stripes:
+            with lock:
+                for key, s in stats.items():
+                    self._stats(merged, key).merge(s)
+        return dict((key, RestDict(
+                        count=s.count,
+                        statuses=s.statuses,
+                        in_flight=s.in_flight,
+                        request_bytes=s.request_bytes,
+                        response_bytes=s.response_bytes,
+                        latency=s.latency,
+                        buckets=list(zip(self.buckets + (float('inf'),),
+                                         _cumulative(s.buckets)))))
+                    for key, s in merged.items())
+
+    def prometheus(self):
+        '''Render a snapshot in the Prometheus text exposition format
+
+        '''
+        snapshot = sorted(self.snapshot().items())
+        lines = []
+        def metric(name, kind, help, samples):
+            lines.append('# HELP {0} {1}'.format(name, help))
+            lines.append('# TYPE {0} {1}'.format(name, kind))
+            for suffix, labels, value in samples:
+                lines.append('{0}{1}{{{2}}} {3}'.format(
+                    name, suffix,
+                    ','.join('{0}="{1}"'.format(k, _escape(v))
+                             for k, v in labels),
+                    value))
+        labels = lambda key: (('method', key[0]), ('path', key[1]))
+        metric('rs_requests_total', 'counter', 'Requests handled.',
+               [('', labels(key) + (('status', status),), count)
+                for key, s in snapshot
+                for status, count in sorted(s.statuses.items())])
+        metric('rs_requests_in_flight', 'gauge', 'Requests being handled.',
+               [('', labels(key), s.in_flight) for key, s in snapshot])
+        metric('rs_request_bytes_total', 'counter', 'Request body bytes.',
+               [('', labels(key), s.request_bytes) for key, s in snapshot])
+        metric('rs_response_bytes_total', 'counter', 'Response body bytes.',
+               [('', labels(key), s.response_bytes) for key, s in snapshot])
+        samples = []
+        for key, s in snapshot:
+            for le, count in s.buckets:
+                samples.append(('_bucket',
+                                labels(key) + (('le', _format_le(le)),),
+                                count))
+            samples.append(('_sum', labels(key), repr(s.latency)))
+            samples.append(('_count', labels(key), s.count))
+        metric('rs_request_duration_seconds', 'histogram',
+               'Time to produce the response.', samples)
+        return '\n'.join(lines) + '\n'
+
+
+def metrics_resource(metrics, path='/metrics'):
+    '''Build a resource serving the metrics in Prometheus text format
+
+    It is not added to rs.core.registry, so only the application it is
+    given to serves it.
+    '''
+    from rs.resource import ResourceBuilder
+    def metrics_target():
+        return metrics.prometheus()
+    set_rest_dict(metrics_target, RestDict(
+        method='GET',
+        path='/' + path.strip('/'),
+        producer=('text/plain;version=0.0.4;charset=utf-8', None)))
+    return ResourceBuilder(metrics_target).build()[0]
+
+
+def _cumulative(counts):
+    total, cumulative = 0, []
+    for count in counts:
+        total += count
+        cumulative.append(total)
+    return cumulative
+
+
+def _format_le(le):
+    return '+Inf' if le == float('inf') else repr(le)
+
+
+def _escape(value):
+    return (str(value).replace('\\', '\\\\')
+                      .replace('"', '\\"')
+                      .replace('\n', '\\n'))
@@ -0,0 +1,89 @@
+from rs.status import NOT_FOUND, responses
+
+
+__all__ = [
+    'PrefixDispatcher',
+    'ASGIPrefixDispatcher',
+]
+
+
+_NOT_FOUND = '{0} {1}'.format(NOT_FOUND, responses[NOT_FOUND])
+
+
+class PrefixDispatcher(object):
+    '''WSGI application routing requests to applications by path prefix
+    
+    The longest mounted prefix wins, found with one dict lookup per
+    distinct depth of the prefixes. Mounted applications see the prefix
+    moved from PATH_INFO to SCRIPT_NAME, the default one gets the others.
+    '''
+    def __init__(self, mounts=None, default=None):
+        self.default = default
+        self.table = ({}, ()) #(prefix -> application, depths longest first)
+        for prefix, app in (mounts or {}).items():
+            self.mount(prefix, app)
+
+    def mount(self, prefix, app):
+        prefix = '/' + prefix.strip('/')
+        if prefix == '/':
+            self.default = app
+            return
+        apps = dict(self.table[0])
+        apps[prefix] = app
+        depths = sorted(set(p.count('/') for p in apps), reverse=True)
+        self.table = apps, tuple(depths)
+
+    def match(self, path):
+        '''Return (prefix, application), ('', default) if none matches
+        
+        '''
+        apps, depths = self.table
+        for depth in depths:
+            parts = path.split('/', depth + 1)
+            if len(parts) > depth:
+                prefix = '/'.join(parts[:depth + 1])
+                app = apps.get(prefix)
+                if app is not None:
+                    return prefix, app
+        return '', self.default
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO') or '/'
+        prefix, app = self.match(path)
+        if app is None:
+            start_response(_NOT_FOUND, [('content-length', '0')])
+            return []
+        if prefix:
+            environ['SCRIPT_NAME'] = environ.get('SCRIPT_NAME', '') + prefix
+            environ['PATH_INFO'] = path[len(prefix):] or '/'
+        return app(environ, start_response)
+
+
+class ASGIPrefixDispatcher(PrefixDispatcher):
+    '''ASGI sibling of PrefixDispatcher
+
+    The prefix is moved from the path to the root_path of the scope.
+    Lifespan events are acknowledged, not forwarded.
+    '''
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            while True:
+                message = await receive()
+                if message['type'] == 'lifespan.startup':
+                    await send({'type': 'lifespan.startup.complete'})
+                elif message['type'] == 'lifespan.shutdown':
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+        path = scope.get('path') or '/'
+        prefix, app = self.match(path)
+        if app is None:
+            await send({'type': 'http.response.start',
+                        'status': NOT_FOUND,
+                        'headers': [(b'content-length', b'0')]})
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+        if prefix:
+            scope = dict(scope,
+                         root_path=scope.get('root_path', '') + prefix,
+                         path=path[len(prefix):] or '/')
+        await app(scope, receive, send)
@@ -0,0 +1,250 @@
+import re
+
+from collections.abc import Mapping
+from tempfile import SpooledTemporaryFile
+from urllib.parse import unquote
+
+from rs.error import Error
+from rs.message import parse_media, entity
+from rs.status import BAD_REQUEST, REQUEST_ENTITY_TOO_LARGE
+
+
+__all__ = [
+    'Part',
+    'FormData',
+    'parse_multipart',
+]
+
+
+SPOOL_SIZE = 1 << 20       # file parts larger than this are spooled to disk
+MAX_FIELD_LENGTH = 1 << 20 # of the parts without filename, kept in memory
+MAX_PARTS = 1000
+
+_MAX_HEADERS_LENGTH = 16384
+_READ_LENGTH = 65536 # larger than CHUNK_LENGTH, uploads are big
+
+_DISPOSITION_PARAM = re.compile(
+    r';\s*([^\s=;]+)\s*=\s*("(?:[^"\\]|\\.)*"|[^;]*)')
+
+
+class Part(object):
+    '''A file part of a multipart/form-data body
+    
+    Its content is in file, in memory up to the spool size, on disk beyond.
+    '''
+    __slots__ = ('name', 'filename', 'media', 'headers', 'file', 'length')
+
+    def __init__(self, name, filename, media, headers, file, length):
+        self.name = name
+        self.filename = filename
+        self.media = media
+        self.headers = headers
+        self.file = file
+        self.length = length
+
+    def read(self, size=-1):
+        return self.file.read(size)
+
+    def seek(self, offset, whence=0):
+        return self.file.seek(offset, whence)
+
+    def close(self):
+        self.file.close()
+
+    def __repr__(self):
+        return 'Part({0!r}, {1!r}, {2} bytes)'.format(self.name,
+                                                     self.filename,
+                                                     self.length)
+
+
+class FormData(Mapping):
+    '''Fields of a multipart/form-data request, parsed on first access
+    
+    Values are str for plain fields, Part for files and lists of them for
+    repeated names.
+    '''
+    __slots__ = ('_request', '_fields')
+
+    def __init__(self, request):
+        self._request = request
+        self._fields = None
+
+    @property
+    def fields(self):
+        if self._fields is None:
+            request = self._request
+            media = parse_media(request.headers.get('content-type'))
+            self._fields = parse_multipart(request.stream,
+                                           (media.boundary or '').strip('"'),
+                                           *(request.multipart or ()))
+        return self._fields
+
+    def __getitem__(self, name):
+        return self.fields[name]
+
+    def __contains__(self, name):
+        return name in self.fields
+
+    def __iter__(self):
+        return iter(self.fields)
+
+    def __len__(self):
+        return len(self.fields)
+
+    def close(self):
+        '''Close the files of the parts, deleting the spooled ones
+        
+        '''
+        _close_parts(self._fields or {})
+
+
+def parse_multipart(stream, boundary, spool_size=SPOOL_SIZE,
+                    max_part_length=None, max_field_length=MAX_FIELD_LENGTH,
+                    max_parts=MAX_PARTS):
+    '''Parse a multipart/form-data body read from stream in chunks
+    
+    Return {name: value} as FormData.fields. Parts longer than their
+    maximum length or more than max_parts are 413, malformed bodies 400.
+    '''
+    if not boundary or len(boundary) > 70 or stream is None:
+        raise Error(BAD_REQUEST)
+    reader = _Reader(stream)
+    delimiter = b'--' + boundary.encode('latin-1')
+    fields, count = {}, 0
+    try:
+        reader.copy_until(delimiter, None) #the preamble
+        delimiter = b'\r\n' + delimiter
+        while reader.peek(2) != b'--':
+            count += 1
+            if count > max_parts:
+                raise Error(REQUEST_ENTITY_TOO_LARGE)
+            headers = _parse_headers(
+                reader.read_until(b'\r\n\r\n', _MAX_HEADERS_LENGTH))
+            name, filename = _disposition(headers)
+            if filename is None:
+                data = bytearray()
+                reader.copy_until(delimiter, data.extend, max_field_length)
+                charset = parse_media(headers.get('content-type') or
+                                      'text/plain').charset
+                _add(fields, name, entity(bytes(data), charset))
+            else:
+                part = Part(name, filename,
+                            headers.get('content-type') or
+                            'application/octet-stream',
+                            headers, SpooledTemporaryFile(spool_size), 0)
+                _add(fields, name, part) #closed on errors from now on
+                part.length = reader.copy_until(delimiter, part.file.write,
+                                                max_part_length)
+                part.seek(0)
+    except BaseException:
+        _close_parts(fields)
+        raise
+    return fields
+
+
+class _Reader(object):
+    '''Buffered reads of a stream, 400 if it ends too early
+    
+    '''
+    __slots__ = ('stream', 'buffer')
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffer = bytearray()
+
+    def fill(self):
+        chunk = self.stream.read(_READ_LENGTH)
+        if not chunk:
+            raise Error(BAD_REQUEST)
+        self.buffer.extend(chunk)
+
+    def peek(self, size):
+        while len(self.buffer) < size:
+            self.fill()
+        return bytes(self.buffer[:size])
+
+    def read_until(self, separator, limit):
+        buffer, start = self.buffer, 0
+        while True:
+            i = buffer.find(separator, start)
+            if i >= 0:
+                data = bytes(buffer[:i])
+                del buffer[:i + len(separator)]
+                return data
+            if len(buffer) > limit:
+                raise Error(BAD_REQUEST)
+            start = max(len(buffer) - len(separator) + 1, 0)
+            self.fill()
+
+    def copy_until(self, separator, write, limit=None):
+        '''Pass the data up to separator to write, return its length
+        
+        '''
+        buffer, length = self.buffer, 0
+        keep = len(separator) - 1 #a separator may begin at the end
+        while True:
+            i = buffer.find(separator)
+            size = i if i >= 0 else len(buffer) - keep
+            if size > 0:
+                length += size
+                if limit is not None and length > limit:
+                    raise Error(REQUEST_ENTITY_TOO_LARGE)
+                if write is not None:
+                    write(bytes(buffer[:size]))
+                del buffer[:size]
+            if i >= 0:
+                del buffer[:len(separator)]
+                return length
+            self.fill()
+
+
+def _add(fields, name, value):
+    if name not in fields:
+        fields[name] = value
+    elif isinstance(fields[name], list):
+        fields[name].append(value)
+    else:
+        fields[name] = [fields[name], value]
+
+
+def _close_parts(fields):
+    for value in fields.values():
+        for part in (value if isinstance(value, list) else [value]):
+            if isinstance(part, Part):
+                part.close()
+
+
+def _parse_headers(block):
+    headers = {}
+    for line in block.decode('utf-8', 'replace').split('\r\n'):
+        if not line:
+            continue
+        name, sep, value = line.partition(':')
+        if not sep:
+            raise Error(BAD_REQUEST)
+        headers[name.strip().lower()] = value.strip()
+    return headers
+
+
+def _disposition(headers):
+    '''Return the (name, filename) of a part, filename None for fields
+    
+    '''
+    value = headers.get('content-disposition', '')
+    if value.split(';', 1)[0].strip().lower() != 'form-data':
+        raise Error(BAD_REQUEST)
+    params = {}
+    for k, v in _DISPOSITION_PARAM.findall(value):
+        if v.startswith('"'):
+            v = re.sub(r'\\(.)', r'\1', v[1:-1])
+        params[k.lower()] = v.strip()
+    if 'filename*' in params: #RFC 5987 charset'language'value
+        charset, _, v = params['filename*'].partition("'")
+        try:
+            params['filename'] = unquote(v.partition("'")[2],
+                                         charset or 'utf-8', 'strict')
+        except (LookupError, UnicodeDecodeError):
+            pass
+    if 'name' not in params:
+        raise Error(BAD_REQUEST)
+    return params['name'], params.get('filename')
@@ -0,0 +1,84 @@
+import gc
+import os
+import signal
+import time
+
+from logging import getLogger
+
+
+__all__ = [
+    'serve',
+]
+
+
+_logger = getLogger(__name__)
+
+_POLL_INTERVAL = 0.5 # seconds a worker waits for a request before polling
+_RESPAWN_DELAY = 1.0 # seconds between restarts of a crash looping worker
+
+
+def serve(server, workers, work=None):
+    '''Serve forever with workers processes forked from the current one
+
+    The workers share the listening socket of the server. Workers that die
+    are restarted, SIGTERM or SIGINT lets them finish the current request
+    and exit. work(server), if given, serves in each worker instead.
+    '''
+    if hasattr(gc, 'freeze'): # keep the built resources shared after fork
+        gc.collect()
+        gc.freeze()
+    children = {}
+    stopping = []
+
+    def stop(signum, frame):
+        stopping.append(signum)
+        for pid in children:
+            try: os.kill(pid, signal.SIGTERM)
+            except OSError: pass
+
+    handlers = dict((signum, signal.signal(signum, stop))
+                    for signum in (signal.SIGTERM, signal.SIGINT))
+    try:
+        for _ in range(workers):
+            children[_spawn(server, work or _work)] = time.time()
+        while children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            started = children.pop(pid, None)
+            if started is None or stopping:
+                continue
+            _logger.warning('worker %d exited with status %d', pid, status)
+            if time.time() - started < _RESPAWN_DELAY:
+                time.sleep(_RESPAWN_DELAY)
+            if not stopping:
+                children[_spawn(server, work or _work)] = time.time()
+    finally:
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+
+
+def _spawn(server, work):
+    pid = os.fork()
+    if pid:
+        _logger.info('worker %d started', pid)
+        return pid
+    status = 0
+    try:
+        work(server)
+    except Exception:
+        _logger.exception('worker %d failed', os.getpid())
+        status = 1
+    finally:
+        os._exit(status)
+
+
+def _work(server):
+    stopping = []
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda signum, frame: stopping.append(signum))
+    server.timeout = _POLL_INTERVAL
+    server.socket.setblocking(False) # another worker may win the accept
+    while not stopping:
+        server.handle_request()
@@ -1,30 +1,102 @@
 
 
-import re
-
-from sys import maxsize
 from urllib.parse import parse_qs
 
 from rs.core import RestDict
 from rs.error import Error
-from rs.message import parse_media, parse_accept
-from rs.status import (NOT_FOUND, NOT_ACCEPTABLE,
+from rs.message import parse_media, accept_quality, entity, CHUNK_LENGTH
+from rs.multipart import FormData
+from rs.resource import ResourceTree
+from rs.status import (NOT_FOUND, NOT_ACCEPTABLE, REQUEST_ENTITY_TOO_LARGE,
                        UNSUPPORTED_MEDIA_TYPE, METHOD_NOT_ALLOWED)
 
 
 __all__ = [
     'Request',
+    'RequestEntity',
+    'RequestDispatcher',
     'dispatch',
 ]
 
 
 class Request(object):
+
+    __slots__ = ('method', 'uri', 'version', 'headers', 'stream', 'multipart',
+                 '_entity')
+
     def __init__(self):
         self.method = None
         self.uri = None
         self.version = None
         self.headers = {}
-        self.entity = None
+        self.stream = None #RequestEntity, read on demand
+        self.multipart = None #(spool_size, max_part_length) of form parts
+        self._entity = None
+
+    @property
+    def entity(self):
+        '''The request body decoded on first access
+        
+        '''
+        if self._entity is None and self.stream is not None:
+            charset = parse_media(self.headers.get('content-type') or
+                                  'application/octet-stream').charset
+            self._entity = entity(self.stream.read(), charset)
+        return self._entity
+
+    @entity.setter
+    def entity(self, value):
+        self._entity = value
+
+
+class RequestEntity(object):
+    '''File-like view of at most length bytes of the WSGI input
+    
+    A length of None reads an input terminated by its end, up to
+    max_length bytes.
+    '''
+    def __init__(self, input, length, max_length=None):
+        if (max_length is not None and length is not None and
+            length > max_length):
+            raise Error(REQUEST_ENTITY_TOO_LARGE)
+        self._input = input
+        self.length = length
+        self.remaining = length
+        self.max_length = max_length
+        self.consumed = 0
+
+    def read(self, size=-1):
+        if self.remaining is None:
+            return self._read_terminated(size)
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self._input.read(size) if size else b''
+        self.remaining -= len(data)
+        self.consumed += len(data)
+        return data
+
+    def _read_terminated(self, size):
+        if size is None or size < 0: #by chunks, to stop past max_length
+            return b''.join(iter(lambda: self._read_terminated(CHUNK_LENGTH),
+                                 b''))
+        if self.max_length is not None: #a byte past it is enough to know
+            size = min(size, self.max_length - self.consumed + 1)
+        data = self._input.read(size)
+        self.consumed += len(data)
+        if self.max_length is not None and self.consumed > self.max_length:
+            raise Error(REQUEST_ENTITY_TOO_LARGE)
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        memoryview(buffer)[:len(data)] = data
+        return len(data)
+
+    def __iter__(self):
+        chunk = self.read(CHUNK_LENGTH)
+        while chunk:
+            yield chunk
+            chunk = self.read(CHUNK_LENGTH)
 
         
 class RequestDispatcher(object):
@@ -33,10 +105,13 @@ class RequestDispatcher(object):
         
         self.resources = resources
         self.q_key = {}
-        self.m_key = {}
-        self.params = RestDict()
+        self.p_key = {}
         
     def dispatch(self, request):
+        resource, path_params = self.resolve(request)
+        return resource, self.extract_params(request, path_params)
+
+    def resolve(self, request):
         resources = self.resources
         try:
             self.resources = self.resolve_path(request.uri.path)
@@ -47,24 +122,17 @@ class RequestDispatcher(object):
                 request.headers.get('accept'))
             self.resources = sorted(
                 self.resources,
-                key=lambda res: (self.q_key.get(res, 1),
-                                 len(self.m_key[res].groups()) or maxsize,
-                                 len(res.path),),
+                key=lambda res: (self.q_key.get(res, 1), res.rank),
                 reverse=True)
             resource = self.resources[0]
-            self.params.path = self.extract_path_params(self.m_key[resource])
-            self.params.query = self.extract_query_params(request.uri.query)
-            self.params.form = self.extract_form_params(request)
-            return resource, self.params
+            return resource, self.extract_path_params(self.p_key[resource])
         finally:
             self.__init__(resources)
 
     def resolve_path(self, path):
         resources = []
-        for res in self.resources:
-            m = res.pattern.match(path.strip('/'))
-            if not m: continue
-            self.m_key[res] = m
+        for res, params in self.resources.match(path):
+            self.p_key[res] = params
             resources.append(res)
         if not resources:
             raise Error(NOT_FOUND)
@@ -84,16 +152,9 @@ class RequestDispatcher(object):
         if not media:
             resources = self.resources
         else:
-            def resolve_consumer(consumer):
-                if consumer:
-                    supported_media, consumer = consumer
-                    supported_media = parse_media(supported_media)
-                    return re.match(supported_media.value.replace('*', '.*'),
-                                    parse_media(media).value)
-                else:
-                    return True
+            media = parse_media(media).value
             resources = [res for res in self.resources
-                         if resolve_consumer(res.consumer)]
+                         if not res._consumes or res._consumes.match(media)]
             if not resources:
                 raise Error(UNSUPPORTED_MEDIA_TYPE)
         return resources
@@ -102,20 +163,10 @@ class RequestDispatcher(object):
         if not accept:
             resources = self.resources
         else:
-            def resolve_producer(producer):
-                if producer:
-                    produced_media, producer = producer
-                    produced_media = parse_media(produced_media)
-                    for accepted_media in parse_accept(accept):
-                        if re.match(accepted_media.value.replace('*', '.*'),
-                                    produced_media.value):
-                            return (float(accepted_media.q)
-                                    if accepted_media.q else 1.0)
-                else:
-                    return 1.0
             resources = []
             for res in self.resources:
-                q = resolve_producer(res.producer)
+                q = (accept_quality(accept, res._produces)
+                     if res._produces else 1.0)
                 if not q: continue
                 self.q_key[res] = q
                 resources.append(res)
@@ -123,8 +174,15 @@ class RequestDispatcher(object):
                 raise Error(NOT_ACCEPTABLE)
         return resources
 
-    def extract_path_params(self, match):
-        return match.groupdict() or {}
+    def extract_params(self, request, path_params):
+        params = RestDict()
+        params.path = path_params
+        params.query = self.extract_query_params(request.uri.query)
+        params.form = self.extract_form_params(request)
+        return params
+
+    def extract_path_params(self, params):
+        return params or {}
 
     def extract_query_params(self, query):
         parsed = parse_qs(query, True) if query else {}
@@ -132,6 +190,10 @@ class RequestDispatcher(object):
                     for k,v in parsed.items()])
 
     def extract_form_params(self, request):
+        if (request.method in ('POST', 'PUT') and
+            request.headers.get('content-type', '')[:19].lower() ==
+                'multipart/form-data'):
+            return FormData(request)
         if ('POST' == request.method and
             'application/x-www-form-urlencoded' ==
                 request.headers.get('content-type', '').lower()):
@@ -140,4 +202,6 @@ class RequestDispatcher(object):
             
 
 def dispatch(resources, request):
+    if not isinstance(resources, ResourceTree):
+        resources = ResourceTree(resources)
     return RequestDispatcher(resources).dispatch(request)
\ No newline at end of file
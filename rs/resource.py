@@ -1,21 +1,44 @@
 
 
+import json
 import re
 
 from inspect import getfullargspec
+from sys import maxsize
 from types import FunctionType
 
+from rs.context import make_binder
 from rs.core import has_rest_dict, get_rest_dict
+from rs.message import (parse_media, media_pattern, json_producer,
+                        json_consumer)
 
 
 
 __all__ = [
     'Resource',
+    'ResourceTree',
     'build_all',
 ]
 
 
+_PARAM = re.compile(r'''\{
+                        (.+?)    #groups
+                        \}''', re.VERBOSE)
+
+_TAIL = re.compile(r'^\{([^{}]+)\*\}$') #'{param*}', the rest of the path
+
+
 class Resource(object):
+
+    __slots__ = ('method', 'path', 'consumer', 'producer', 'cache', 'etag',
+                 'validators', 'compress', 'limit', 'deadline', 'pattern',
+                 'rank', 'target', 'host', '_consumes', '_produces',
+                 '_fullargspec', '_args_defs', '_binder')
+
+    #attributes copied from __rest_dict__ by ResourceBuilder.build_resource
+    _rest_keys = frozenset(('method', 'consumer', 'producer', 'cache', 'etag',
+                            'validators', 'compress', 'limit',
+                            'deadline'))
     
     def __init__(self):
         '''init the Resource
@@ -26,13 +49,23 @@ class Resource(object):
         self.path = None
         self.consumer = None
         self.producer = None
+        self.cache = None #(ttl, vary) of cached responses
+        self.etag = None #'strong' or 'weak' automatic ETag
+        self.validators = None #(etag, last_modified) functions of Context
+        self.compress = None #'off' if the responses must not be compressed
+        self.limit = None #(max_in_flight, queue, timeout, retry_after)
+        self.deadline = None #seconds a request may last
         
         self.pattern = None
+        self.rank = None #precomputed dispatch ranking, see build_resource
         self.target = None #target function to be invoke
         self.host = None #host of the target
         
+        self._consumes = None # compiled pattern of the consumed media
+        self._produces = None # value of the produced media
         self._fullargspec = None # a list of argument names of target
         self._args_defs = {} #default params and its values of target
+        self._binder = None #function of a Context returning the target args
 
     def __hash__(self):
         return hash(self.target)
@@ -78,8 +111,8 @@ class ResourceBuilder(object):
         resource = Resource()
                 
         for k,v in get_rest_dict(target).items():
-            if k in resource.__dict__ and not resource.__dict__.get(k) and k != 'path':
-                resource.__dict__[k] = v
+            if k in Resource._rest_keys and not getattr(resource, k):
+                setattr(resource, k, v)
         
         #build path
         resource.path='/'
@@ -96,17 +129,33 @@ class ResourceBuilder(object):
         resource.target = target
                 
         params = dict(('{{{0}}}'.format(p),
-                       '(?P<{0}>.+)'.format(p)
-                      ) for p in re.findall(r'''\{
-                                            (.+?)    #groups
-                                            \}''', resource.path, re.VERBOSE))
+                       '(?P<{0}>.+)'.format(p.rstrip('*'))
+                      ) for p in _PARAM.findall(resource.path))
         
         pattern = resource.path
         for k,v in params.items():
-            pattern = re.sub(k, v, pattern)
+            pattern = pattern.replace(k, v)
                     
         resource.pattern = re.compile(r'^{0}$'.format(pattern.strip('/'))) #match exactly the path
         
+        #static paths first, then more params, then no '{param*}' tail,
+        #then longer paths
+        resource.rank = (len(resource.pattern.groupindex) or maxsize,
+                         not resource.path.rstrip('/').endswith('*}'),
+                         len(resource.path))
+        
+        #plain json.dumps/loads are swapped for the cached bytes encoders
+        if resource.producer and resource.producer[1] is json.dumps:
+            resource.producer = resource.producer[0], json_producer()
+        if resource.consumer and resource.consumer[1] is json.loads:
+            resource.consumer = resource.consumer[0], json_consumer()
+        
+        if resource.consumer:
+            resource._consumes = media_pattern(
+                parse_media(resource.consumer[0]).value)
+        if resource.producer:
+            resource._produces = parse_media(resource.producer[0]).value
+        
         if host:
             resource.host = host
             
@@ -114,9 +163,119 @@ class ResourceBuilder(object):
         if resource._fullargspec.defaults:
             tmp = resource._fullargspec
             resource._args_defs = dict(zip(tmp.args[-(len(tmp.defaults)):], tmp.defaults))
+        resource._binder = make_binder(resource)
         
         return resource
 
+class _Node(object):
+    '''A node of the ResourceTree, one per path segment
+    
+    '''
+    __slots__ = ('static', 'patterns', 'param', 'tail', 'resources')
+
+    def __init__(self):
+        self.static = {}    #segment -> child node
+        self.patterns = {}  #segment -> (compiled segment regex, child node)
+        self.param = None   #child node of a whole '{param}' segment
+        self.tail = None    #child node of a '{param*}' last segment
+        self.resources = [] #resources ending at this node
+
+
+class ResourceTree(object):
+    '''Segment based radix tree of resources
+    
+    Lookup cost depends on the depth of the path, not on the number of 
+    resources. Each '{param}' segment matches exactly one path segment, a
+    '{param*}' last segment matches all the remaining ones.
+    '''
+    def __init__(self, resources=()):
+        self._root = _Node()
+        self._resources = []
+        self._binders = {} #resource -> ((index, name, regex), ...)
+        for resource in resources:
+            self.add(resource)
+
+    def __iter__(self):
+        return iter(self._resources)
+
+    def __len__(self):
+        return len(self._resources)
+
+    def add(self, resource):
+        node, binders = self._root, []
+        segments = split_path(resource.path)
+        for i, segment in enumerate(segments):
+            tail = _TAIL.match(segment)
+            if tail:
+                if i != len(segments) - 1:
+                    raise ValueError('{0} must be the last segment of {1}'
+                                     .format(segment, resource.path))
+                if node.tail is None:
+                    node.tail = _Node()
+                node = node.tail
+                binders.append((slice(i, None), tail.group(1), None))
+            elif not _PARAM.search(segment):
+                node = node.static.setdefault(segment, _Node())
+            elif _PARAM.sub('', segment, 1) == '' and segment.count('{') == 1:
+                if node.param is None:
+                    node.param = _Node()
+                node = node.param
+                binders.append((i, segment[1:-1], None))
+            else:
+                if segment not in node.patterns:
+                    regex = re.compile('^{0}$'.format(_PARAM.sub(
+                        lambda m: '(?P<{0}>.+)'.format(m.group(1)),
+                        segment)))
+                    node.patterns[segment] = regex, _Node()
+                regex, node = node.patterns[segment]
+                binders.append((i, None, regex))
+        node.resources.append(resource)
+        self._resources.append(resource)
+        self._binders[resource] = tuple(binders)
+
+    def match(self, path):
+        '''Return a list of (resource, path params) matching the path
+        
+        '''
+        segments = split_path(path)
+        depth = len(segments)
+        found = []
+        stack = [(self._root, 0)]
+        while stack:
+            node, i = stack.pop()
+            if i == depth:
+                found.extend(node.resources)
+                continue
+            segment = segments[i]
+            child = node.static.get(segment)
+            if child is not None:
+                stack.append((child, i + 1))
+            if segment:
+                for regex, child in node.patterns.values():
+                    if regex.match(segment):
+                        stack.append((child, i + 1))
+                if node.param is not None:
+                    stack.append((node.param, i + 1))
+                if node.tail is not None:
+                    found.extend(node.tail.resources)
+        return [(res, self.bind(res, segments)) for res in found]
+
+    def bind(self, resource, segments):
+        params = {}
+        for i, name, regex in self._binders[resource]:
+            if regex is None:
+                params[name] = (segments[i] if isinstance(i, int) else
+                                '/'.join(segments[i]))
+            else:
+                params.update(regex.match(segments[i]).groupdict())
+        return params
+
+
+def split_path(path):
+    path = path.strip('/')
+    return path.split('/') if path else []
+
+
 def build_all(resources):
     resources = set(resources)
     
@@ -130,4 +289,4 @@ def build_all(resources):
     resources = sum(map(lambda resource : ResourceBuilder(resource).build(), 
                         resources),
                          [])
-    return resources
\ No newline at end of file
+    return ResourceTree(resources)
\ No newline at end of file
@@ -2,6 +2,8 @@
 
 class Response(object):
 
+    __slots__ = ('status', 'headers', 'entity')
+
     def __init__(self, status=None):
         self.status  = status
         self.headers = {}
@@ -7,6 +7,7 @@ CONFLICT = 409
 CONTINUE = 100
 CREATED = 201
 FORBIDDEN = 403
+GATEWAY_TIMEOUT = 504
 GONE = 410
 INTERNAL_SERVER_ERROR = 500
 METHOD_NOT_ALLOWED = 405
@@ -17,6 +18,7 @@ NOT_FOUND = 404
 NOT_MODIFIED = 304
 OK = 200
 PRECONDITION_FAILED = 412
+REQUEST_ENTITY_TOO_LARGE = 413
 SEE_OTHER = 303
 SERVICE_UNAVAILABLE = 503
 TEMPORARY_REDIRECT = 307